@@ -1,30 +1,42 @@
+import re
+import httpx
+import asyncio
+import requests
+from contextlib import aclosing
 from pydantic import BaseModel, Field
 from typing import Optional, Annotated
 
-from langchain_core.messages import HumanMessage, AIMessage, AnyMessage
+from langchain_core.messages import (
+    HumanMessage,
+    AIMessage,
+    AnyMessage,
+    RemoveMessage,
+    message_chunk_to_message,
+    get_buffer_string,
+)
+from langchain_core.output_parsers import StrOutputParser
 from langgraph.types import Command, interrupt, RetryPolicy
-from langgraph.graph import add_messages
+from langgraph.graph import END, add_messages
 from langgraph.config import get_stream_writer
 
-from e2b_code_interpreter import Sandbox
-
-from agent.llms import (
-    reasoning_model,
-    reasoning_model_large,
-    chat_model_anthropic_first,
-    o3,
-    claude_4_opus,
-)
+from agent import llms
 from agent.utils import (
     extract_code_block,
+    strip_code_comments,
     parse_e2b_execution_results,
-    get_e2b_sandbox,
-    upload_file_to_e2b_sandbox,
+    upload_files_to_e2b_sandbox,
+    get_e2b_variables_dir,
+    get_e2b_sandbox_by_id,
+    reconnect_e2b_sandbox,
+    register_e2b_sandbox,
+    forget_e2b_sandbox,
     get_code_to_load_uploaded_file,
-    format_results,
+    format_execution_results_stream,
     truncate_string_middle,
 )
+from agent.llm_cache import ainvoke_structured
 from agent.state import Data, OverallState
+from agent.sandbox_pool import sandbox_pool
 
 
 class ValidationResult(BaseModel):
@@ -53,34 +65,53 @@ class StepState(OverallState):
     )
     code_block: str = Field(default="")
     variables_to_save: list[VariableToSave] = Field(default_factory=list)
+    history_cap: int = Field(default=30)
+    summarized_message_count: int = Field(default=0)
     checklist_validation_result: Optional[ValidationResult] = Field(default=None)
     critic_validation_result: Optional[list[ValidationResult]] = Field(default=None)
 
 
 def get_init_e2b_sandbox_node(state_type):
-    def init_e2b_sandbox(state: state_type):
+    async def init_e2b_sandbox(state: state_type):
         writer = get_stream_writer()
         writer({"oneline_message": "🔧 Setting up execution environment..."})
 
-        # initialize a new sandbox with the given locals
-        e2b_sandbox = get_e2b_sandbox()
-        file_paths: list[str] = []
-        for variable in state.variables:
-            file_path: str = upload_file_to_e2b_sandbox(
-                e2b_sandbox, variable.value, f"{variable.key}.{variable.type}"
-            )
-            file_paths.append(file_path)
+        # The previous step's sandbox still has the saved variables loaded in its
+        # kernel, so keep using it instead of starting and loading a new one
+        if state.sandbox_id and await asyncio.to_thread(
+            reconnect_e2b_sandbox, state.sandbox_id
+        ):
+            writer({"oneline_message": "✅ Environment ready!"})
+            return {"sandbox_id": state.sandbox_id}
+
+        # take a warm sandbox from the pool and load the given locals into it
+        e2b_sandbox = await asyncio.to_thread(sandbox_pool.acquire)
+
+        # The bulk upload doesn't create missing directories, so create it up front
+        await asyncio.to_thread(e2b_sandbox.files.make_dir, get_e2b_variables_dir())
+
+        # All files go in one request instead of one round-trip per variable
+        file_paths = await asyncio.to_thread(
+            upload_files_to_e2b_sandbox, e2b_sandbox, state.variables
+        )
 
         code_to_load_uploaded_file = get_code_to_load_uploaded_file(
             state.variables, file_paths
         )
 
         # run the script that defines and loads the variables
-        execution = e2b_sandbox.run_code(code_to_load_uploaded_file)
+        execution = await asyncio.to_thread(
+            e2b_sandbox.run_code, code_to_load_uploaded_file
+        )
 
         if execution.error:
             raise Exception(f"Error initializing sandbox: {execution.error.traceback}")
 
+        # The previous step's sandbox is gone, so drop its cached handle
+        if state.sandbox_id:
+            forget_e2b_sandbox(state.sandbox_id)
+        register_e2b_sandbox(e2b_sandbox)
+
         writer({"oneline_message": "✅ Environment ready!"})
 
         return {
@@ -90,11 +121,259 @@ def get_init_e2b_sandbox_node(state_type):
     return init_e2b_sandbox
 
 
-def get_code_agent_node(state_type, max_message_turn: int, next_node_name: str):
-    def agent(state: state_type):
+def get_close_e2b_sandbox_node(state_type):
+    async def close_e2b_sandbox(state: state_type):
+        if not state.sandbox_id:
+            return {}
+
+        try:
+            e2b_sandbox = get_e2b_sandbox_by_id(state.sandbox_id)
+            await asyncio.to_thread(e2b_sandbox.kill)
+        except Exception as e:
+            # The sandbox times out on its own anyway, so don't fail the run
+            print(f"Failed to kill sandbox {state.sandbox_id}: {e}")
+        forget_e2b_sandbox(state.sandbox_id)
+
+        return {"sandbox_id": ""}
+
+    return close_e2b_sandbox
+
+
+# "DONE" has to be on its own line at the very end of the response, so that it doesn't
+# match inside code, prose or words like "ABANDONED"
+DONE_PATTERN = re.compile(r"(?:^|\n)\s*DONE\s*$")
+
+
+def is_done_response(content: str) -> bool:
+    """
+    Check if the agent's response signals the end of the step.
+
+    Args:
+        content: The text content of the agent's response
+
+    Returns:
+        True if the response is a bare "DONE" (in any case, with optional trailing
+        punctuation) or ends with "DONE" on its own line
+    """
+    # The prompt asks for a bare "DONE", so that's the common case and needs no regex.
+    # Accepting "Done." here also saves a clarification round-trip with the LLM.
+    if content.strip().rstrip(".!").upper() == "DONE":
+        return True
+    return bool(DONE_PATTERN.search(content))
+
+
+# The system prompt and the first human message are never summarized
+HISTORY_HEAD_LENGTH = 2
+
+# python_executor outputs older than this many turns are shortened to a preview
+COMPACT_KEEP_TURNS = 3
+COMPACT_PREVIEW_LENGTH = 200
+COMPACTED_OUTPUT_MARKER = "chars of old output omitted"
+DATAFRAME_SHAPE_PATTERN = re.compile(r"DataFrame \(\d+ rows x \d+ columns\)")
+
+# The number of messages that each partial summary covers when writing step reports
+REPORT_MAP_CHUNK_SIZE = 6
+
+
+def compact_history(
+    history: list[AnyMessage],
+) -> tuple[list[AnyMessage], list[AnyMessage]]:
+    """
+    Shortens the python_executor outputs that are older than the last few turns to a
+    preview, since the agent has already read them and they are resent every turn.
+
+    Compacted messages keep their id and position, and the updates write them back to
+    the state, so each output is shortened once and the prompt prefix stays stable.
+
+    Args:
+        history: The step message history
+
+    Returns:
+        tuple: The compacted history and the add_messages updates that apply it
+    """
+    compacted_history = list(history)
+    updates = []
+    for i, message in enumerate(history[: -2 * COMPACT_KEEP_TURNS]):
+        if (
+            not isinstance(message, HumanMessage)
+            or message.name != "python_executor"
+            or not isinstance(message.content, str)
+            or len(message.content) <= COMPACT_PREVIEW_LENGTH
+            or COMPACTED_OUTPUT_MARKER in message.content
+        ):
+            continue
+
+        # Keep the dataframe shapes, they are the part the agent refers back to most
+        shapes = DATAFRAME_SHAPE_PATTERN.findall(message.content)
+        content = (
+            f"{message.content[:COMPACT_PREVIEW_LENGTH]}"
+            f"... [{len(message.content) - COMPACT_PREVIEW_LENGTH} {COMPACTED_OUTPUT_MARKER}]"
+        )
+        if shapes:
+            content += "\n" + "\n".join(shapes)
+
+        compacted_history[i] = message.model_copy(update={"content": content})
+        updates.append(compacted_history[i])
+
+    return compacted_history, updates
+
+
+async def cap_step_message_history(
+    history: list[AnyMessage], history_cap: int
+) -> tuple[list[AnyMessage], list[AnyMessage], int]:
+    """
+    Folds the middle of a long message history into a single summary message so that
+    the prompt and the checkpointed state stay bounded by history_cap.
+
+    Args:
+        history: The step message history
+        history_cap: The number of messages above which the history is summarized
+
+    Returns:
+        tuple: The capped history, the add_messages updates that apply it to the
+            state, and the number of messages that were folded away
+    """
+    if len(history) <= history_cap:
+        return history, [], 0
+
+    # Keep the latest half of the history. Start it on a human message so that the
+    # summary, an AI message, keeps the turns alternating.
+    tail_start = len(history) - history_cap // 2
+    while tail_start < len(history) and not isinstance(
+        history[tail_start], HumanMessage
+    ):
+        tail_start += 1
+
+    middle = history[HISTORY_HEAD_LENGTH:tail_start]
+    if len(middle) < 2:
+        return history, [], 0
+
+    summary = await (
+        llms.get_model("chat_model_anthropic_first_small") | StrOutputParser()
+    ).ainvoke(
+        [
+            *history[:tail_start],
+            HumanMessage(
+                content="Summarize the work done in this conversation so far: the code that was run, what was found, the variables that were created and what is left to do. Keep variable names and important numbers. This summary will replace the messages above."
+            ),
+        ]
+    )
+
+    # Reusing the id of the first folded message replaces it in place, so the summary
+    # keeps its position in the history
+    summary_message = AIMessage(
+        id=middle[0].id,
+        content=f"Here is a summary of my earlier work in this step:\n{summary}",
+    )
+    updates = [
+        summary_message,
+        *[RemoveMessage(id=message.id) for message in middle[1:]],
+    ]
+    capped_history = [
+        *history[:HISTORY_HEAD_LENGTH],
+        summary_message,
+        *history[tail_start:],
+    ]
+
+    return capped_history, updates, len(middle) - 1
+
+
+async def map_step_message_history(
+    history: list[AnyMessage], chunk_size: int
+) -> list[AnyMessage]:
+    """
+    Replaces the work trace of a long history with short summaries of its chunks,
+    written in parallel, so that the prompt of the call that follows stays small.
+
+    Args:
+        history: The step message history
+        chunk_size: The number of messages that each summary covers
+
+    Returns:
+        list[AnyMessage]: The head of the history followed by one message with the
+            summaries in order, or the history itself if it's short enough
+    """
+    head = history[:HISTORY_HEAD_LENGTH]
+    body = history[HISTORY_HEAD_LENGTH:]
+    if len(body) <= 2 * chunk_size:
+        return history
+
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    summaries = await asyncio.gather(
+        *[
+            (llms.get_model("reasoning_model_large") | StrOutputParser()).ainvoke(
+                [
+                    *head,
+                    HumanMessage(
+                        content=f"""
+Here is part {i + 1} of {len(chunks)} of the work that was done in this step:
+
+{get_buffer_string(chunk)}
+
+Summarize this part: the code that was run, what was found, the variables that were created and any issues. Keep variable names, methods and important numbers.
+""".strip()
+                    ),
+                ]
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+    )
+
+    work_summary = "\n\n".join(
+        f"<part_{i + 1}>\n{summary}\n</part_{i + 1}>"
+        for i, summary in enumerate(summaries)
+    )
+    return [
+        *head,
+        AIMessage(
+            content=f"Here is a summary of the work I did in this step, in order:\n\n{work_summary}"
+        ),
+    ]
+
+
+async def stream_agent_response(history: list[AnyMessage]) -> AIMessage:
+    """
+    Streams the code agent's response to the stream writer token by token. Since the
+    agent may write only one code block per response, generation stops as soon as the
+    first python code block is closed.
+    """
+    writer = get_stream_writer()
+
+    response = None
+    code_block_start = -1
+    scanned_length = 0
+    async with aclosing(
+        llms.get_model("chat_model_anthropic_first").astream(history)
+    ) as stream:
+        async for chunk in stream:
+            response = chunk if response is None else response + chunk
+            if not isinstance(chunk.content, str) or not chunk.content:
+                continue
+
+            writer({"token": chunk.content})
+
+            content = response.content
+            if code_block_start < 0:
+                code_block_start = content.find("```python", max(scanned_length - 9, 0))
+            if code_block_start >= 0 and (
+                content.find("```", max(code_block_start + 9, scanned_length - 3)) >= 0
+            ):
+                break
+            scanned_length = len(content)
+
+    if response is None:
+        return AIMessage(content="")
+    return message_chunk_to_message(response)
+
+
+def get_code_agent_node(
+    state_type, max_message_turn: int, next_node_name: str | list[str]
+):
+    async def agent(state: state_type):
         writer = get_stream_writer()
 
-        if len(state.step_message_history) > (2 * max_message_turn):
+        message_count = len(state.step_message_history) + state.summarized_message_count
+        if message_count > (2 * max_message_turn):
             writer({"oneline_message": "⚠️ Maximum iteration limit reached"})
             return Command(
                 goto=next_node_name,
@@ -107,18 +386,43 @@ def get_code_agent_node(state_type, max_message_turn: int, next_node_name: str):
                 },
             )
 
+        history, compact_updates = compact_history(state.step_message_history)
+        history, history_updates, summarized_count = await cap_step_message_history(
+            history, state.history_cap
+        )
+        history_updates = [*compact_updates, *history_updates]
+        summarized_message_count = state.summarized_message_count + summarized_count
+
         writer({"oneline_message": "💭 Analyzing and planning next steps..."})
-        response = chat_model_anthropic_first.invoke(state.step_message_history)
+        response = await stream_agent_response(history)
 
         code_block = extract_code_block(response)
 
-        is_done = "DONE" in response.content
+        # A code block always wins over DONE, see common_prompts.samples_of_using_done
+        is_done = code_block is None and is_done_response(response.content)
 
-        if code_block:
+        if code_block is not None and not strip_code_comments(code_block):
+            # Nothing to run, so don't spend a sandbox round-trip on it
+            writer({"oneline_message": "🤔 Clarifying response format..."})
+            return Command(
+                update={
+                    "step_message_history": [
+                        *history_updates,
+                        response,
+                        HumanMessage(
+                            content="Your code block was empty. If you need more exploration tasks, write the code you want to run in the code block. If the exploration process is all done, simply return DONE with all capital letters without any code block."
+                        ),
+                    ],
+                    "summarized_message_count": summarized_message_count,
+                },
+                goto=agent.__name__,
+            )
+        elif code_block:
             writer({"oneline_message": "⚡ Executing code..."})
             return Command(
                 update={
-                    "step_message_history": [response],
+                    "step_message_history": [*history_updates, response],
+                    "summarized_message_count": summarized_message_count,
                     "code_block": code_block,
                 },
                 goto="python_executor",
@@ -129,21 +433,36 @@ def get_code_agent_node(state_type, max_message_turn: int, next_node_name: str):
             class VariableToSaveList(BaseModel):
                 variable_list: list[VariableToSave]
 
+            # Picking variable names only needs the code that was run, not the whole
+            # trace with its outputs, so a small model with a short prompt is enough
+            code_trace = "\n\n".join(
+                f"```python\n{code}\n```"
+                for message in history
+                if isinstance(message, AIMessage)
+                and (code := extract_code_block(message))
+            )
+            if summarized_message_count:
+                code_trace = f"{history[HISTORY_HEAD_LENGTH].content}\n\n{code_trace}"
+
             variables_to_save: VariableToSaveList = (
-                reasoning_model.with_structured_output(VariableToSaveList).invoke(
+                await llms.get_model("chat_model_anthropic_first_small")
+                .with_structured_output(VariableToSaveList)
+                .ainvoke(
                     [
-                        *state.step_message_history,
-                        response,
                         HumanMessage(
-                            content="""
-    Great job! Now, you need to wrap up this step by selecting variable that needs to be persist to the next step. Read your code trace carefully and pick dataframe, list, dictionary, string variables that is necessary for the further steps. Be mindful to not include everything.
-
-    - You can only select the following types of variables:
-        - Dataframe
-        - List
-        - Dictionary
-        - String
-    """.strip()
+                            content=f"""
+Here is the code that you've run in this step:
+
+{code_trace}
+
+Great job! Now, you need to wrap up this step by selecting variable that needs to be persist to the next step. Read your code trace carefully and pick dataframe, list, dictionary, string variables that is necessary for the further steps. Be mindful to not include everything.
+
+- You can only select the following types of variables:
+    - Dataframe
+    - List
+    - Dictionary
+    - String
+""".strip()
                         ),
                     ]
                 )
@@ -151,7 +470,8 @@ def get_code_agent_node(state_type, max_message_turn: int, next_node_name: str):
             return Command(
                 update={
                     "variables_to_save": variables_to_save.variable_list,
-                    "step_message_history": [response],
+                    "step_message_history": [*history_updates, response],
+                    "summarized_message_count": summarized_message_count,
                 },
                 goto=[
                     "checklist_validator",
@@ -163,11 +483,13 @@ def get_code_agent_node(state_type, max_message_turn: int, next_node_name: str):
             return Command(
                 update={
                     "step_message_history": [
+                        *history_updates,
                         response,
                         HumanMessage(
                             content="Can you check your last response again? It seems like you didn't write the code in the code block and it doesn't include DONE. If the exploration process is all done, simply return DONE with all capital letters. If you need more exploration tasks, write the code in a proper code block (```python\n[code]\n```)."
                         ),
                     ],
+                    "summarized_message_count": summarized_message_count,
                 },
                 goto=agent.__name__,
             )
@@ -176,27 +498,29 @@ def get_code_agent_node(state_type, max_message_turn: int, next_node_name: str):
 
 
 def get_python_executor_node(state_type):
-    def python_executor(state: StepState):
+    async def python_executor(state: StepState):
         writer = get_stream_writer()
         writer({"oneline_message": "🐍 Running Python code..."})
 
-        e2b_sandbox = Sandbox(sandbox_id=state.sandbox_id)
+        e2b_sandbox = get_e2b_sandbox_by_id(state.sandbox_id)
 
-        execution = e2b_sandbox.run_code(state.code_block)
+        execution = await asyncio.to_thread(e2b_sandbox.run_code, state.code_block)
 
         error = execution.error
         logs = execution.logs
-        parsed_results = parse_e2b_execution_results(execution.results)
 
         formatted_stdout = "\n".join(logs.stdout)
         formatted_stderr = "\n".join(logs.stderr)
-        formatted_results = format_results(parsed_results)
+        formatted_results = "\n".join(
+            format_execution_results_stream(execution.results)
+        )
 
         if error:
             writer({"oneline_message": "❌ Code execution encountered an error"})
             content = error.name + ": " + error.value
-            traceback = "\n\n<traceback>\n" + error.traceback + "\n</traceback>"
-            content += truncate_string_middle(traceback, 1000)
+            # Truncate before wrapping so a huge traceback isn't copied just to be cut
+            traceback = truncate_string_middle(error.traceback, 1000)
+            content += f"\n\n<traceback>\n{traceback}\n</traceback>"
         else:
             writer({"oneline_message": "✅ Code executed successfully"})
             content_parts = []
@@ -212,7 +536,10 @@ def get_python_executor_node(state_type):
         return Command(
             update={
                 "step_message_history": [
-                    HumanMessage(content=content or "No output from the code block.")
+                    HumanMessage(
+                        content=content or "No output from the code block.",
+                        name=python_executor.__name__,
+                    )
                 ],
             },
             goto="agent",
@@ -222,30 +549,54 @@ def get_python_executor_node(state_type):
 
 
 def get_save_variables_node(state_type):
-    def save_variables(state: state_type):
+    async def save_variables(state: state_type):
         writer = get_stream_writer()
         writer({"oneline_message": "💾 Saving important variables for next step..."})
 
-        e2b_sandbox = Sandbox(sandbox_id=state.sandbox_id)
+        # The max-iteration path finishes without selecting variables, keep the
+        # variables from the earlier steps instead of replacing them with nothing
+        if not state.variables_to_save:
+            writer(
+                {
+                    "oneline_message": "⏭️ No variables selected, keeping the previous ones"
+                }
+            )
+            return {}
+
+        e2b_sandbox = get_e2b_sandbox_by_id(state.sandbox_id)
+
+        # Fetch every variable in a single execution instead of one round-trip each.
+        # All values are evaluated before anything is displayed, so a missing variable
+        # fails the whole cell and the results stay aligned with variables_to_save.
+        keys = [variable_to_save.key for variable_to_save in state.variables_to_save]
+        execution = await asyncio.to_thread(
+            e2b_sandbox.run_code,
+            "from IPython.display import display\n"
+            f"for __value in [eval(__key) for __key in {keys!r}]:\n"
+            "    display(__value)",
+        )
+
+        if execution.error:
+            raise Exception(f"Error saving variable: {execution.error.traceback}")
+
+        parsed_results = parse_e2b_execution_results(execution.results)
+        if len(parsed_results) != len(state.variables_to_save):
+            raise Exception(
+                f"Error saving variable: expected {len(state.variables_to_save)} results but got {len(parsed_results)}"
+            )
 
         final_variables = []
-        for variable_to_save in state.variables_to_save:
-            # For each variable, we need to get the value of them from the sandbox
-            execution = e2b_sandbox.run_code(f"{variable_to_save.key}")
-
-            if execution.error:
-                raise Exception(f"Error saving variable: {execution.error.traceback}")
-
-            parsed_results = parse_e2b_execution_results(execution.results)
-            for value, type in parsed_results:
-                final_variables.append(
-                    Data(
-                        key=variable_to_save.key,
-                        type=type,
-                        description=variable_to_save.description,
-                        value=value,
-                    )
+        for variable_to_save, (value, type) in zip(
+            state.variables_to_save, parsed_results
+        ):
+            final_variables.append(
+                Data(
+                    key=variable_to_save.key,
+                    type=type,
+                    description=variable_to_save.description,
+                    value=value,
                 )
+            )
 
         writer({"oneline_message": f"✅ Saved {len(final_variables)} variables"})
 
@@ -254,18 +605,73 @@ def get_save_variables_node(state_type):
     return save_variables
 
 
-def get_checklist_validator_node(checklist: str, step_state):
-    def checklist_validator(state: step_state):
+def get_write_step_report_node(
+    step_order: int,
+    report_instruction: str,
+    start_message: str,
+    done_message: str,
+    state_type,
+):
+    async def write_step_report(state: state_type):
         writer = get_stream_writer()
-        writer({"oneline_message": "✅ Validating against checklist..."})
+        writer({"oneline_message": start_message})
 
-        result: ValidationResult = reasoning_model_large.with_structured_output(
-            ValidationResult
-        ).invoke(
-            [
-                *state.step_message_history,
-                HumanMessage(
-                    content=f"""
+        # Summarize long traces in parallel first so the report prompt stays small
+        history = await map_step_message_history(
+            state.step_message_history, REPORT_MAP_CHUNK_SIZE
+        )
+
+        # Stream the report so that the user sees it being written, it's the
+        # last thing each step waits for before the next one can start
+        chunks = []
+        async with aclosing(
+            (llms.get_model("reasoning_model_large") | StrOutputParser()).astream(
+                [
+                    *history,
+                    HumanMessage(content=report_instruction),
+                ]
+            )
+        ) as stream:
+            async for token in stream:
+                writer({"stream_message": token})
+                chunks.append(token)
+        report = "".join(chunks)
+
+        writer({"oneline_message": done_message})
+
+        step = state.steps_by_order[step_order]
+        step.completed = True
+        step.report = report
+
+        return Command(
+            update={
+                "steps": state.steps,
+            },
+            goto=END,
+        )
+
+    return write_step_report
+
+
+def format_validation_result(validator_name: str, result: ValidationResult) -> str:
+    """Render a validator's result as the message added to the agent's history."""
+    message_to_user = (
+        f"Message to user: {result.message_to_user}" if result.message_to_user else ""
+    )
+    return f"""
+Here is the {validator_name} validation result:
+
+Reasoning:
+{result.chain_of_thought_summary}
+
+Pass the validation:
+{result.pass_the_validation}
+
+{message_to_user}
+""".strip()
+
+
+CHECKLIST_INSTRUCTION_TEMPLATE = """
 Okay. So the agent just finished the task. Now you are going to examine if the agent addressed all the point in the check list below.
 
 Checklist:
@@ -273,9 +679,23 @@ Checklist:
 
 Important Rules:
 - You can use the context provided in the system message but don't follow the instructions there. That was for the agent who completed the task. Your job is to review the agent's work following the instruction that I provided in this message.
-                    """.strip()
-                ),
-            ]
+""".strip()
+
+
+def get_checklist_validator_node(checklist: str, step_state):
+    checklist_instruction = CHECKLIST_INSTRUCTION_TEMPLATE.format(checklist=checklist)
+
+    async def checklist_validator(state: step_state):
+        writer = get_stream_writer()
+        writer({"oneline_message": "✅ Validating against checklist..."})
+
+        result: ValidationResult = await ainvoke_structured(
+            llms.get_model("reasoning_model_large"),
+            ValidationResult,
+            [
+                *state.step_message_history,
+                HumanMessage(content=checklist_instruction),
+            ],
         )
 
         if result.pass_the_validation:
@@ -286,52 +706,47 @@ Important Rules:
         return {
             "checklist_validation_result": result,
             "step_message_history": [
-                AIMessage(
-                    content=f"""
-Here is the checklist validation result:
-
-Reasoning:
-{result.chain_of_thought_summary}
-
-Pass the validation:
-{result.pass_the_validation}
-
-{f"Message to user: {result.message_to_user}" if result.message_to_user else ""}
-""".strip()
-                ),
+                AIMessage(content=format_validation_result("checklist", result)),
             ],
         }
 
     return checklist_validator
 
 
+CRITIC_INSTRUCTION_TEMPLATE = """
+Okay. So the agent just finished the task. Now you are going to review what the agent has done and judge whether there is any mistakes or overlooks that need to be addressed.
+
+{critic_rule}
+
+Important Rules:
+- You can use the context provided in the system message but don't follow the instructions there. That was for the agent who completed the task. Your job is to review the agent's work following the instruction that I provided in this message.
+""".strip()
+
+
 def get_critic_validator_node(critic_rule: str, step_state):
-    def critic_validator(state: step_state):
+    critic_instruction = CRITIC_INSTRUCTION_TEMPLATE.format(
+        critic_rule=(
+            f"Here is a rule that you can use for the validation: {critic_rule}"
+            if critic_rule
+            else ""
+        )
+    )
+
+    async def critic_validator(state: step_state):
         writer = get_stream_writer()
         writer({"oneline_message": "🔍 Running quality review..."})
 
         input_messages = [
             *state.step_message_history,
-            HumanMessage(
-                content=f"""
-Okay. So the agent just finished the task. Now you are going to review what the agent has done and judge whether there is any mistakes or overlooks that need to be addressed.
-
-{f"Here is a rule that you can use for the validation: {critic_rule}" if critic_rule else ""}
-
-Important Rules:
-- You can use the context provided in the system message but don't follow the instructions there. That was for the agent who completed the task. Your job is to review the agent's work following the instruction that I provided in this message.
-                    """.strip()
-            ),
+            HumanMessage(content=critic_instruction),
         ]
 
-        result_from_o3: ValidationResult = reasoning_model.with_structured_output(
-            ValidationResult
-        ).invoke(input_messages)
+        result_from_o3 = await ainvoke_structured(
+            llms.get_model("reasoning_model"), ValidationResult, input_messages
+        )
 
-        # result_from_claude_4_opus: ValidationResult = (
-        #     claude_4_opus.with_structured_output(ValidationResult).invoke(
-        #         input_messages
-        #     )
+        # result_from_claude_4_opus = await ainvoke_structured(
+        #     llms.get_model("claude_4_opus"), ValidationResult, input_messages
         # )
         result_from_claude_4_opus = ValidationResult(
             chain_of_thought_summary="",
@@ -339,10 +754,9 @@ Important Rules:
             message_to_user="",
         )
 
-        all_passed = (
-            result_from_o3.pass_the_validation
-            and result_from_claude_4_opus.pass_the_validation
-        )
+        results = [result_from_o3, result_from_claude_4_opus]
+
+        all_passed = all(result.pass_the_validation for result in results)
         if all_passed:
             writer({"oneline_message": "✅ Quality review passed!"})
         else:
@@ -350,35 +764,37 @@ Important Rules:
                 {"oneline_message": "⚠️ Quality review identified improvements needed"}
             )
 
-        results = [result_from_o3, result_from_claude_4_opus]
-
         return {
             "critic_validation_result": results,
             "step_message_history": [
-                AIMessage(
-                    content=f"""
-Here is the critic validation result:
-
-Reasoning:
-{result.chain_of_thought_summary}
-
-Pass the validation:
-{result.pass_the_validation}
-
-{f"Message to user: {result.message_to_user}" if result.message_to_user else ""}
-""".strip()
-                )
-                for result in results
+                AIMessage(content=format_validation_result("critic", critic_result))
+                for critic_result in results
             ],
         }
 
     return critic_validator
 
 
+RENDEVOUS_MESSAGE_TEMPLATE = """
+Finished {step_name} just now! Can you check the validation result?
+
+Checklist validation result:
+{checklist_validation_summary}
+
+Critic validation result:
+{critic_validation_summary}
+
+Now you can either:
+- type "pass" or just press enter with no input to RESUME the agent's flow
+- type a message that will be INSERTED into the agent's message history
+- type "ignore" to IGNORE the validation result and go to the next step
+""".strip()
+
+
 def get_rendevous_node(
-    next_node_name: str, agent_node_name: str, step_name: str, state_type
+    next_node_name: str | list[str], agent_node_name: str, step_name: str, state_type
 ):
-    def rendevous(state: state_type):
+    async def rendevous(state: state_type):
         writer = get_stream_writer()
 
         if state.use_human_in_the_loop:
@@ -396,20 +812,15 @@ def get_rendevous_node(
             else:
                 critic_validation_summary = "No critic validation results"
 
-            message_to_user = f"""
-Finished {step_name} just now! Can you check the validation result?
-
-Checklist validation result:
-{"Validation passed" if state.checklist_validation_result.pass_the_validation else state.checklist_validation_result.message_to_user}
-
-Critic validation result:
-{critic_validation_summary}
-
-Now you can either:
-- type "pass" or just press enter with no input to RESUME the agent's flow
-- type a message that will be INSERTED into the agent's message history
-- type "ignore" to IGNORE the validation result and go to the next step
-""".strip()
+            message_to_user = RENDEVOUS_MESSAGE_TEMPLATE.format(
+                step_name=step_name,
+                checklist_validation_summary=(
+                    "Validation passed"
+                    if state.checklist_validation_result.pass_the_validation
+                    else state.checklist_validation_result.message_to_user
+                ),
+                critic_validation_summary=critic_validation_summary,
+            )
 
             user_input = interrupt({"message_to_user": message_to_user})
 
@@ -504,75 +915,36 @@ Now you can either:
 
 
 # ===========================================
-#                 Shared Prompts
+#                 Retry Policy
 # ===========================================
-prompt_asking_agent_to_write_code_iteratively = """
-To accomplish this, you will first think for a while and explain what you're going to do in your response. Then write Python code in your response using a code block (```python\n[code]\n```). You will write the code, run it, and then check the result. Repeat this process until the data is fully cleaned. The code should be as minimal as possible—avoid writing a long script that tries to handle everything at once. If there's an error early in a long script, the rest of the code won't run and may become irrelevant or require rewriting, which leads to wasted effort. A step-by-step approach—writing short, focused code, executing it, checking the output, and then proceeding—is more reliable. Think of each response as a Jupyter Notebook cell—each should contain semantically independent code.
-
-Here is an example:
-<example>
-Hmm okay, so the column 'color' has missing values. But it's not that many. I'll simply fill them with the most frequent value.
-
-```python
-df.fillna({'color': df['color'].mode()[0]})
-```
-</example>
-""".strip()
-
-samples_of_using_done = """
-<correct_example>
-DONE
-</correct_example>
-
-<incorrect_example>
-Okay this is the last code block. Let's drop the null values.
-
-```python
-df.dropna()
-```
-
-DONE
-</incorrect_example>
-
-<incorrect_example>
-Okay! It looks all good now. We can move on to the next step.
-
-DONE
-</incorrect_example>
-""".strip()
+# Exceptions that come from the code or data itself, so retrying won't help.
+# ConnectionError and requests.HTTPError are OSErrors too and are checked first.
+_NON_RETRYABLE = (
+    ValueError,
+    TypeError,
+    ArithmeticError,
+    ImportError,
+    LookupError,
+    NameError,
+    SyntaxError,
+    RuntimeError,
+    ReferenceError,
+    StopIteration,
+    StopAsyncIteration,
+    OSError,
+)
 
 
-# ===========================================
-#                 Retry Policy
-# ===========================================
 def retry_on(exc: Exception) -> bool:
     print(f"[Retry policy captured an exception]\n{exc}\n")
-    import httpx
-    import requests
 
-    if isinstance(exc, ConnectionError):
-        return True
     if isinstance(exc, httpx.HTTPStatusError):
         return 500 <= exc.response.status_code < 600
+    if isinstance(exc, ConnectionError):
+        return True
     if isinstance(exc, requests.HTTPError):
         return 500 <= exc.response.status_code < 600 if exc.response else True
-    if isinstance(
-        exc,
-        (
-            ValueError,
-            TypeError,
-            ArithmeticError,
-            ImportError,
-            LookupError,
-            NameError,
-            SyntaxError,
-            RuntimeError,
-            ReferenceError,
-            StopIteration,
-            StopAsyncIteration,
-            OSError,
-        ),
-    ):
+    if isinstance(exc, _NON_RETRYABLE):
         return False
     return True
 
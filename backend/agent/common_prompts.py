@@ -0,0 +1,102 @@
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    SystemMessagePromptTemplate,
+    HumanMessagePromptTemplate,
+)
+
+# ===========================================
+#                 Shared Prompts
+# ===========================================
+prompt_asking_agent_to_write_code_iteratively = """
+To accomplish this, you will first think for a while and explain what you're going to do in your response. Then write Python code in your response using a code block (```python\n[code]\n```). You will write the code, run it, and then check the result. Repeat this process until the data is fully cleaned. The code should be as minimal as possible—avoid writing a long script that tries to handle everything at once. If there's an error early in a long script, the rest of the code won't run and may become irrelevant or require rewriting, which leads to wasted effort. A step-by-step approach—writing short, focused code, executing it, checking the output, and then proceeding—is more reliable. Think of each response as a Jupyter Notebook cell—each should contain semantically independent code.
+
+Here is an example:
+<example>
+Hmm okay, so the column 'color' has missing values. But it's not that many. I'll simply fill them with the most frequent value.
+
+```python
+df.fillna({'color': df['color'].mode()[0]})
+```
+</example>
+""".strip()
+
+samples_of_using_done = """
+<correct_example>
+DONE
+</correct_example>
+
+<incorrect_example>
+Okay this is the last code block. Let's drop the null values.
+
+```python
+df.dropna()
+```
+
+DONE
+</incorrect_example>
+
+<incorrect_example>
+Okay! It looks all good now. We can move on to the next step.
+
+DONE
+</incorrect_example>
+""".strip()
+
+
+# ===========================================
+#            Base ReAct Prompt (steps 2-4)
+# ===========================================
+BASE_REACT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(
+            [
+                # Identical for every step, so the cached prefix is shared across steps
+                """
+You are a ReAct(reason and act) data analyst agent specializing in wiritng code to achieve the objective. 
+
+---
+
+## How to use "DONE" in your response
+Once the work of the current step is complete, simply return "DONE" (all capital letters) as your response without any other text or code block.
+
+{samples_of_using_done}
+
+---
+
+## How to write code
+{prompt_asking_agent_to_write_code_iteratively}
+
+---
+
+## Important Rules
+- You can write only one python code block in each response. Don't add more than one code block.
+- Make sure to write the code in the code block.
+- Refrain from writing the entire code at once.
+- Don't plot graphs. You are not a multi-modal agent. You can only understand text.
+    """.strip(),
+                # Static per step
+                """
+{step_focus_section}
+    """.strip(),
+                # Changes with every run
+                """
+## Additional context
+The final objective of this whole data analysis is the following: {objective} {objective_note}
+
+Here is the description and samples of the data that you have access to:
+{variable_descriptions}
+
+{previous_step_section}
+    """.strip(),
+            ]
+        ),
+        HumanMessagePromptTemplate.from_template(
+            """
+Okay, let's start.
+    """.strip()
+        ),
+    ]
+).partial(
+    prompt_asking_agent_to_write_code_iteratively=prompt_asking_agent_to_write_code_iteratively,
+    samples_of_using_done=samples_of_using_done,
+)
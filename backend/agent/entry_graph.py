@@ -4,19 +4,16 @@ from langgraph.checkpoint.memory import MemorySaver
 from .state import OverallState, InputState, OutputState
 from .utils import get_current_step, CustomSerializer
 
-from .steps.step_1_define_objective import g as step_1_define_objective
-from .steps.step_2_data_cleaning import g as step_2_data_cleaning
-from .steps.step_3_data_exploration import g as step_3_data_exploration
-from .steps.step_4_data_analysis import g as step_4_data_analysis
-from .steps.step_5_write_report import g as step_5_write_report
+from .steps import step_1_define_objective
+from .steps import step_2_data_cleaning
+from .steps import step_3_data_exploration
+from .steps import step_4_data_analysis
+from .steps import step_5_write_report
 
 
 def check_if_skip_any_step(state: OverallState):
     if state.skip_define_objective_step:
-        for step in state.steps:
-            if step.order == 1:
-                step.completed = True
-                break
+        state.steps_by_order[1].completed = True
         return {"steps": state.steps}
     else:
         return {}
@@ -60,19 +57,19 @@ g.add_conditional_edges(
     ],
 )
 
-g.add_node("step_1_define_objective", step_1_define_objective)
+g.add_node("step_1_define_objective", step_1_define_objective.graph())
 g.add_edge("step_1_define_objective", "step_2_data_cleaning")
 
-g.add_node("step_2_data_cleaning", step_2_data_cleaning)
+g.add_node("step_2_data_cleaning", step_2_data_cleaning.graph())
 g.add_edge("step_2_data_cleaning", "step_3_data_exploration")
 
-g.add_node("step_3_data_exploration", step_3_data_exploration)
+g.add_node("step_3_data_exploration", step_3_data_exploration.graph())
 g.add_edge("step_3_data_exploration", "step_4_data_analysis")
 
-g.add_node("step_4_data_analysis", step_4_data_analysis)
+g.add_node("step_4_data_analysis", step_4_data_analysis.graph())
 g.add_edge("step_4_data_analysis", "step_5_write_report")
 
-g.add_node("step_5_write_report", step_5_write_report)
+g.add_node("step_5_write_report", step_5_write_report.graph())
 g.add_edge("step_5_write_report", END)
 
 serializer = CustomSerializer()
@@ -87,7 +84,3 @@ g = g.compile(
     #     "step_5_write_report",
     # ],
 )
-
-
-with open("entry_graph.png", "wb") as f:
-    f.write(g.get_graph().draw_mermaid_png())
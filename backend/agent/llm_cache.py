@@ -0,0 +1,134 @@
+import os
+import json
+import asyncio
+import sqlite3
+import hashlib
+from contextlib import aclosing, closing
+from typing import AsyncIterator, Sequence, TypeVar
+
+from pydantic import BaseModel
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.db")
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+
+def _connect() -> sqlite3.Connection:
+    connection = sqlite3.connect(LLM_CACHE_PATH)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+    )
+    return connection
+
+
+def _get_model_name(model: Runnable) -> str:
+    # Models with fallbacks are identified by their primary model
+    model = getattr(model, "runnable", model)
+    return str(
+        getattr(model, "model_name", None)
+        or getattr(model, "model", None)
+        or type(model).__name__
+    )
+
+
+def get_cache_key(
+    model: Runnable,
+    messages: Sequence[BaseMessage],
+    schema: type[BaseModel] | None = None,
+) -> str:
+    """
+    Computes a content hash of an LLM call.
+
+    Args:
+        model: The model that will be called
+        messages: The input messages
+        schema: The structured output schema, if any
+
+    Returns:
+        str: The SHA-256 hex digest identifying the call
+    """
+    payload = {
+        "model": _get_model_name(model),
+        # Message ids differ on every run, so only the role and content are hashed
+        "messages": [(message.type, message.content) for message in messages],
+        "schema": schema.model_json_schema() if schema else None,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def lookup(key: str) -> str | None:
+    with closing(_connect()) as connection:
+        row = connection.execute(
+            "SELECT value FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def update(key: str, value: str) -> None:
+    with closing(_connect()) as connection:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+
+
+async def ainvoke_structured(
+    model: Runnable, schema: type[SchemaT], messages: Sequence[BaseMessage]
+) -> SchemaT:
+    """
+    Calls the model with structured output, reusing the stored result of an identical
+    previous call when LLM_CACHE_ENABLED is set. Only use it for deterministic calls.
+    """
+    if not LLM_CACHE_ENABLED:
+        return await model.with_structured_output(schema).ainvoke(messages)
+
+    key = get_cache_key(model, messages, schema)
+    cached = await asyncio.to_thread(lookup, key)
+    if cached is not None:
+        return schema.model_validate_json(cached)
+
+    result = await model.with_structured_output(schema).ainvoke(messages)
+    await asyncio.to_thread(update, key, result.model_dump_json())
+    return result
+
+
+async def astream_text(
+    model: Runnable, messages: Sequence[BaseMessage]
+) -> AsyncIterator[str]:
+    """
+    Streams a plain text response from the model. When LLM_CACHE_ENABLED is set, the
+    stored response of an identical previous call is yielded in one chunk instead, so
+    reruns and retries of a long generation don't pay for the same tokens again.
+    """
+    chain = model | StrOutputParser()
+    if not LLM_CACHE_ENABLED:
+        async with aclosing(chain.astream(messages)) as stream:
+            async for chunk in stream:
+                yield chunk
+        return
+
+    key = get_cache_key(model, messages)
+    cached = await asyncio.to_thread(lookup, key)
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    async with aclosing(chain.astream(messages)) as stream:
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    # Only a complete response is stored, an interrupted stream never reaches here
+    await asyncio.to_thread(update, key, "".join(chunks))
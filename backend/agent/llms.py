@@ -1,8 +1,13 @@
 import os
+import functools
 from dotenv import load_dotenv
 from pydantic import SecretStr
+from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
+from langchain_core.runnables import RunnableLambda
+
+from agent.utils import add_cache_breakpoint
 
 load_dotenv()
 
@@ -35,141 +40,208 @@ openai_reasoning_model_default = "o4-mini"
 openai_reasoning_model_large = "o3-mini"
 
 
+# ===========================================
+#             Shared HTTP clients
+# ===========================================
+@functools.cache
+def _shared_openai_http_clients() -> dict:
+    # Every OpenAI model (fallbacks included) sends requests through the same
+    # connection pool, so concurrent sessions and nodes reuse warm connections
+    # instead of each client paying its own TCP/TLS handshakes
+    return {
+        "http_client": DefaultHttpxClient(),
+        "http_async_client": DefaultAsyncHttpxClient(),
+    }
+
+
 # ===========================================
 #             Non-Reasoning Models
 # ===========================================
-chat_model_anthropic_first = ChatAnthropic(
-    model_name=anthropic_chat_model_default,
-    api_key=anthropic_api_key,
-    temperature=0.5,
-    timeout=120,
-    stop=None,
-).with_fallbacks(
-    [
-        ChatOpenAI(
-            model=openai_chat_model_default,
-            temperature=0.1,
-            api_key=openai_api_key,
-        ),  # switch provider
-        ChatOpenAI(
-            model=openai_reasoning_model_default,
-            temperature=None,
-            api_key=openai_api_key,
-        ),  # try with reasoning model
-    ]
-)
-
-chat_model_openai_first = ChatOpenAI(
-    model=openai_chat_model_default,
-    api_key=openai_api_key,
-    temperature=0.5,
-).with_fallbacks(
-    [
-        ChatAnthropic(
+def _build_chat_model_anthropic_first():
+    # The cache breakpoints are Anthropic content blocks, so they are only added on
+    # the way to ChatAnthropic. The OpenAI fallbacks get the messages unmarked.
+    return (
+        RunnableLambda(add_cache_breakpoint)
+        | ChatAnthropic(
             model_name=anthropic_chat_model_default,
             api_key=anthropic_api_key,
-            temperature=0.1,
+            temperature=0.5,
             timeout=120,
             stop=None,
-        ),  # switch provider
-        ChatOpenAI(
-            model=openai_reasoning_model_default,
-            temperature=None,
-            api_key=openai_api_key,
-        ),  # try with reasoning model
-    ]
-)
+        )
+    ).with_fallbacks(
+        [
+            ChatOpenAI(
+                model=openai_chat_model_default,
+                temperature=0.1,
+                api_key=openai_api_key,
+                **_shared_openai_http_clients(),
+            ),  # switch provider
+            ChatOpenAI(
+                model=openai_reasoning_model_default,
+                temperature=None,
+                api_key=openai_api_key,
+                **_shared_openai_http_clients(),
+            ),  # try with reasoning model
+        ]
+    )
+
+
+def _build_chat_model_openai_first():
+    return ChatOpenAI(
+        model=openai_chat_model_default,
+        api_key=openai_api_key,
+        **_shared_openai_http_clients(),
+        temperature=0.5,
+    ).with_fallbacks(
+        [
+            ChatAnthropic(
+                model_name=anthropic_chat_model_default,
+                api_key=anthropic_api_key,
+                temperature=0.1,
+                timeout=120,
+                stop=None,
+            ),  # switch provider
+            ChatOpenAI(
+                model=openai_reasoning_model_default,
+                temperature=None,
+                api_key=openai_api_key,
+                **_shared_openai_http_clients(),
+            ),  # try with reasoning model
+        ]
+    )
 
 
 # ===========================================
 #                Small Models
 # ===========================================
 
-chat_model_anthropic_first_small = ChatAnthropic(
-    model_name=anthropic_chat_model_small,
-    temperature=0.7,
-    api_key=anthropic_api_key,
-    timeout=120,
-    stop=None,
-).with_fallbacks(
-    [
-        ChatOpenAI(
-            model=openai_chat_model_small,
-            temperature=0.1,
-            api_key=openai_api_key,
-        ),  # switch provider
-    ]
-)
-
-chat_model_openai_first_small = ChatOpenAI(
-    model=openai_chat_model_small,
-    temperature=None,
-    api_key=openai_api_key,
-).with_fallbacks(
-    [
-        ChatAnthropic(
-            model_name=anthropic_chat_model_small,
-            api_key=anthropic_api_key,
-            temperature=0.1,
-            timeout=120,
-            stop=None,
-        ),  # switch provider
-    ]
-)
+
+def _build_chat_model_anthropic_first_small():
+    return ChatAnthropic(
+        model_name=anthropic_chat_model_small,
+        temperature=0.7,
+        api_key=anthropic_api_key,
+        timeout=120,
+        stop=None,
+    ).with_fallbacks(
+        [
+            ChatOpenAI(
+                model=openai_chat_model_small,
+                temperature=0.1,
+                api_key=openai_api_key,
+                **_shared_openai_http_clients(),
+            ),  # switch provider
+        ]
+    )
+
+
+def _build_chat_model_openai_first_small():
+    return ChatOpenAI(
+        model=openai_chat_model_small,
+        temperature=None,
+        api_key=openai_api_key,
+        **_shared_openai_http_clients(),
+    ).with_fallbacks(
+        [
+            ChatAnthropic(
+                model_name=anthropic_chat_model_small,
+                api_key=anthropic_api_key,
+                temperature=0.1,
+                timeout=120,
+                stop=None,
+            ),  # switch provider
+        ]
+    )
+
 
 # ===========================================
 #              Reasoning Models
 # ===========================================
 
 
-reasoning_model = ChatOpenAI(
-    model=openai_reasoning_model_default,
-    temperature=None,
-    # reasoning_effort="high",
-    api_key=openai_api_key,
-).with_fallbacks(
-    [
-        ChatOpenAI(
-            model=openai_reasoning_model_default,
-            temperature=None,
-            # reasoning_effort="high",
-            api_key=openai_api_key,
-        ),  # try one more time
-    ]
-)
-
-reasoning_model_large = ChatOpenAI(
-    model=openai_reasoning_model_large,
-    temperature=None,
-    # reasoning_effort="high",
-    api_key=openai_api_key,
-).with_fallbacks(
-    [
-        ChatOpenAI(
-            model=openai_reasoning_model_large,
-            temperature=None,
-            # reasoning_effort="high",
-            api_key=openai_api_key,
-        ),  # try one more time
-    ]
-)
+def _build_reasoning_model():
+    return ChatOpenAI(
+        model=openai_reasoning_model_default,
+        temperature=None,
+        # reasoning_effort="high",
+        api_key=openai_api_key,
+        **_shared_openai_http_clients(),
+        max_retries=3,  # retry in the client instead of falling back to an identical copy
+    )
+
+
+def _build_reasoning_model_large():
+    return ChatOpenAI(
+        model=openai_reasoning_model_large,
+        temperature=None,
+        # reasoning_effort="high",
+        api_key=openai_api_key,
+        **_shared_openai_http_clients(),
+        max_retries=3,  # retry in the client instead of falling back to an identical copy
+    )
 
 
 # ===========================================
 #              Fixed Models
 # ===========================================
-o3 = ChatOpenAI(
-    model="o3",
-    temperature=None,
-    api_key=openai_api_key,
-)
-
-claude_4_opus = ChatAnthropic(
-    model_name="claude-opus-4-20250514",
-    api_key=anthropic_api_key,
-    timeout=120,
-    stop=None,
-    # temperature=1,  # When thikning mode is on, temp should be 1
-    # max_tokens_to_sample=8000,  # This should be larger then the budget tokens
-    # thinking={"type": "enabled", "budget_tokens": 5000},
-)
+def _build_o3():
+    return ChatOpenAI(
+        model="o3",
+        temperature=None,
+        api_key=openai_api_key,
+        **_shared_openai_http_clients(),
+    )
+
+
+def _build_claude_4_opus():
+    return ChatAnthropic(
+        model_name="claude-opus-4-20250514",
+        api_key=anthropic_api_key,
+        timeout=120,
+        stop=None,
+        # temperature=1,  # When thikning mode is on, temp should be 1
+        # max_tokens_to_sample=8000,  # This should be larger then the budget tokens
+        # thinking={"type": "enabled", "budget_tokens": 5000},
+    )
+
+
+# ===========================================
+#              Lazy construction
+# ===========================================
+_model_factories = {
+    "chat_model_anthropic_first": _build_chat_model_anthropic_first,
+    "chat_model_openai_first": _build_chat_model_openai_first,
+    "chat_model_anthropic_first_small": _build_chat_model_anthropic_first_small,
+    "chat_model_openai_first_small": _build_chat_model_openai_first_small,
+    "reasoning_model": _build_reasoning_model,
+    "reasoning_model_large": _build_reasoning_model_large,
+    "o3": _build_o3,
+    "claude_4_opus": _build_claude_4_opus,
+}
+
+
+def get_model(name: str):
+    """
+    Returns the named model, building its client on first use.
+
+    Graph nodes should call this instead of reading `llms.<name>`: LangGraph scans
+    the attribute chains used in a node's body when compiling the graph, which
+    would build every referenced client at import time.
+
+    Args:
+        name: One of the model names in _model_factories, e.g. "reasoning_model"
+
+    Returns:
+        The chat model, shared between all callers
+    """
+    if name not in globals():
+        globals()[name] = _model_factories[name]()
+    return globals()[name]
+
+
+def __getattr__(name: str):
+    # Keeps `from agent.llms import reasoning_model` working, built on first access
+    if name in _model_factories:
+        return get_model(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from collections import deque
+
+from e2b_code_interpreter import Sandbox
+
+from agent.utils import get_e2b_sandbox, E2B_SANDBOX_TIMEOUT
+
+
+SANDBOX_POOL_SIZE = int(os.getenv("E2B_SANDBOX_POOL_SIZE", "1"))
+
+# Idle sandboxes are killed well before E2B times them out, and are not replaced
+# until the next acquire, so an idle server stops paying for sandboxes
+MAX_IDLE_SECONDS = 60 * 5
+EVICT_INTERVAL_SECONDS = 30
+
+# Imports that every analysis needs anyway, executed while the sandbox is idle
+WARM_UP_CODE = "import pandas as pd\nimport numpy as np\nimport json"
+
+
+class SandboxPool:
+    """Keeps a few E2B sandboxes warm so that a graph run doesn't pay the cold start."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: deque[tuple[float, Sandbox]] = deque()
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._stopped = threading.Event()
+        self._worker: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Starts the background thread that refills the pool after every acquire."""
+        if self.size <= 0 or self._worker is not None:
+            return
+
+        self._stopped.clear()
+        self._refill_needed.set()
+        self._worker = threading.Thread(
+            target=self._run, name="e2b-sandbox-pool", daemon=True
+        )
+        self._worker.start()
+
+    def stop(self) -> None:
+        """Stops refilling the pool and kills the sandboxes that were never used."""
+        self._stopped.set()
+        self._refill_needed.set()
+        if self._worker is not None:
+            self._worker.join(timeout=30)
+            self._worker = None
+
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for _, sandbox in idle:
+            self._kill(sandbox)
+
+    def acquire(self) -> Sandbox:
+        """
+        Hands out a warm sandbox, or creates a new one when the pool is empty.
+
+        Returns:
+            Sandbox: A running E2B Sandbox instance owned by the caller
+        """
+        while True:
+            with self._lock:
+                entry = self._idle.popleft() if self._idle else None
+            self._refill_needed.set()
+
+            if entry is None:
+                return get_e2b_sandbox()
+
+            _, sandbox = entry
+            try:
+                # Restart the sandbox lifetime from the moment it's handed out
+                sandbox.set_timeout(E2B_SANDBOX_TIMEOUT)
+                return sandbox
+            except Exception as e:
+                print(f"Discarding a pooled sandbox that is no longer available: {e}")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            refill = self._refill_needed.wait(timeout=EVICT_INTERVAL_SECONDS)
+            self._refill_needed.clear()
+            self._evict_stale()
+            # Only refill on demand, evicted sandboxes are not replaced while idle
+            if refill:
+                self._fill()
+
+    def _fill(self) -> None:
+        while not self._stopped.is_set():
+            with self._lock:
+                if len(self._idle) >= self.size:
+                    return
+
+            try:
+                sandbox = get_e2b_sandbox()
+                sandbox.run_code(WARM_UP_CODE)
+            except Exception as e:
+                print(f"Failed to warm up a sandbox: {e}")
+                return
+
+            if self._stopped.is_set():
+                self._kill(sandbox)
+                return
+
+            with self._lock:
+                self._idle.append((time.monotonic(), sandbox))
+
+    def _evict_stale(self) -> None:
+        now = time.monotonic()
+        stale: list[Sandbox] = []
+        with self._lock:
+            while self._idle and now - self._idle[0][0] > MAX_IDLE_SECONDS:
+                stale.append(self._idle.popleft()[1])
+        for sandbox in stale:
+            self._kill(sandbox)
+
+    @staticmethod
+    def _kill(sandbox: Sandbox) -> None:
+        try:
+            sandbox.kill()
+        except Exception as e:
+            print(f"Failed to kill a pooled sandbox: {e}")
+
+
+sandbox_pool = SandboxPool(SANDBOX_POOL_SIZE)
@@ -1,4 +1,5 @@
 from typing import Any
+from functools import cached_property
 from enum import Enum
 from pydantic import BaseModel, Field
 
@@ -112,3 +113,8 @@ class OverallState(InputState, OutputState):
 
     steps: list[Step] = Field(default_factory=get_default_steps)
     sandbox_id: str = Field(default="")
+
+    @cached_property
+    def steps_by_order(self) -> dict[int, Step]:
+        # The values are the same Step objects as in steps, so they can be updated in place
+        return {step.order: step for step in self.steps}
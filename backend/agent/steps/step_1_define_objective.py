@@ -1,3 +1,6 @@
+import asyncio
+import functools
+import os
 from pydantic import BaseModel, Field
 from typing import Annotated, Optional
 
@@ -13,7 +16,7 @@ from langgraph.graph import START, END, StateGraph, add_messages
 from langgraph.types import Command, interrupt
 from langgraph.config import get_stream_writer
 
-from agent.llms import chat_model_openai_first
+from agent import llms
 from agent.state import OverallState
 from agent.utils import get_variable_descriptions, get_dataframe_info
 from agent.common import get_checklist_validator_node, ValidationResult, retry_policy
@@ -26,21 +29,29 @@ CHECKLIST = """
 
 MAX_MESSAGE_TURN = 3
 
+# Run the checklist validator even when the agent already judged the request as
+# answerable and specific
+STRICT_VALIDATION = os.getenv("STEP_1_STRICT_VALIDATION", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
 
 class StepState(OverallState):
     step_message_history: Annotated[list[AnyMessage], add_messages] = Field(
         default_factory=list
     )
-    checklist_validation_result: Optional[ValidationResult]
+    checklist_validation_result: Optional[ValidationResult] = Field(default=None)
+    # The agent's message to the user, kept in state so that ask_user can be resumed
+    pending_agent_response: str = Field(default="")
 
 
-def init_message_history(state: StepState):
-    writer = get_stream_writer()
-    writer({"oneline_message": "1️⃣ Initializing the step 1...", "current_step": 1})
-
-    input_messages = ChatPromptTemplate.from_messages(
-        [
-            SystemMessagePromptTemplate.from_template(
+INIT_MESSAGE_HISTORY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(
+            [
+                # Static instructions first so providers can cache them as a prefix
                 """
 You are a data analyst agent. Currently you are in the first step of the data analysis process: Define the objective. In this step your goal is to define the objective of this data analysis with the user. 
 
@@ -50,23 +61,58 @@ Try not to exceed 3 rounds of questions to the user. For example, if the use pro
 
 When checking whether the request is specific enough, use the following criteria:
 {step_1_checklist}
-
+    """.strip(),
+                """
 Here is the variables that you have access to.
 {variable_descriptions}
 {dataframe_info}
-    """.strip()
-            ),
-            HumanMessagePromptTemplate.from_template(
-                """
+    """.strip(),
+            ]
+        ),
+        HumanMessagePromptTemplate.from_template(
+            """
 User request: {user_request}
     """.strip()
-            ),
-        ]
-    ).format_messages(
-        step_1_checklist=CHECKLIST,
-        variable_descriptions=get_variable_descriptions(state.variables),
+        ),
+    ]
+).partial(
+    step_1_checklist=CHECKLIST,
+)
+
+
+class RequestReview(BaseModel):
+    chain_of_thought: str = Field(
+        description="Use this field to think aloud to reason whether the user request is answerable and specific enough to proceed to the next step."
+    )
+    is_request_answerable: bool
+    is_request_specific: bool
+    message_to_user: str = Field(
+        description="If either any of the above is false, you can use this field to send a message to the user to a) explain why the request is not answerable or specific enough and suggest possible new objectives or b) ask the user for more details with some suggestions and suggest more specific objectives. Keep this message short and concise."
+    )
+
+
+@functools.cache
+def get_request_review_model():
+    # Bind the schema once, the structured output runnable is the same for every call
+    return llms.get_model("chat_model_openai_first_small").with_structured_output(
+        RequestReview
+    )
+
+
+async def init_message_history(state: StepState):
+    writer = get_stream_writer()
+    writer({"oneline_message": "1️⃣ Initializing the step 1...", "current_step": 1})
+
+    # Both helpers go through every variable independently, so build them side by side
+    variable_descriptions, dataframe_info = await asyncio.gather(
+        asyncio.to_thread(get_variable_descriptions, state.variables),
+        asyncio.to_thread(get_dataframe_info, state.variables),
+    )
+
+    input_messages = INIT_MESSAGE_HISTORY_PROMPT.format_messages(
+        variable_descriptions=variable_descriptions,
         user_request=state.objective,
-        dataframe_info=get_dataframe_info(state.variables),
+        dataframe_info=dataframe_info,
     )
 
     return {
@@ -74,22 +120,14 @@ User request: {user_request}
     }
 
 
-def agent(state: StepState):
+async def agent(state: StepState):
     writer = get_stream_writer()
 
     writer({"oneline_message": "🔍 Reviewing the user request..."})
 
-    class Schema(BaseModel):
-        chain_of_thought: str = Field(
-            description="Use this field to think aloud to reason whether the user request is answerable and specific enough to proceed to the next step."
-        )
-        is_request_answerable: bool
-        is_request_specific: bool
-        message_to_user: str = Field(
-            description="If either any of the above is false, you can use this field to send a message to the user to a) explain why the request is not answerable or specific enough and suggest possible new objectives or b) ask the user for more details with some suggestions and suggest more specific objectives. Keep this message short and concise."
-        )
-
-    response: Schema = chat_model_openai_first.with_structured_output(Schema).invoke(
+    # Checking if the request is answerable and specific is a light classification,
+    # so the small model is enough. The objective rewrite below keeps the larger one.
+    response: RequestReview = await get_request_review_model().ainvoke(
         state.step_message_history
     )
 
@@ -106,19 +144,46 @@ def agent(state: StepState):
     if response.is_request_answerable and response.is_request_specific:
         writer({"oneline_message": "✅ Checklist passed"})
 
+        if STRICT_VALIDATION:
+            # Double check the agent's decision with the checklist validator
+            return Command(goto="checklist_validator")
+
+        # The agent already applied the checklist, so its decision is the validation
+        return Command(
+            update={
+                "checklist_validation_result": ValidationResult(
+                    chain_of_thought_summary=response.chain_of_thought,
+                    pass_the_validation=True,
+                    message_to_user=None,
+                ),
+            },
+            goto=END,
+        )
+
     else:
-        # If the request is not answerable or specific, we need to ask the user for more details
-        #! TODO: this interrupt should be in a separate node because when the graph resumes, it starts from the beginning of this node, which will trigger the LLM call again.
-        user_response = interrupt(
-            {
-                "message_to_user": response.message_to_user,
-            }
+        # If the request is not answerable or specific, we need to ask the user for more details.
+        # The interrupt is in a separate node so that resuming the graph doesn't rerun the LLM call above.
+        return Command(
+            update={"pending_agent_response": response.message_to_user},
+            goto=ask_user.__name__,
         )
 
-        new_objective = (chat_model_openai_first | StrOutputParser()).invoke(
-            [
-                HumanMessage(
-                    content=f"""
+
+async def ask_user(state: StepState):
+    # On resume LangGraph reruns this node from the top, so the interrupt has to stay
+    # the first statement. Everything after it runs exactly once per user reply.
+    user_response = interrupt(
+        {
+            "message_to_user": state.pending_agent_response,
+        }
+    )
+
+    new_objective = await (
+        llms.get_model("chat_model_openai_first") | StrOutputParser()
+    ).ainvoke(
+        [
+            HumanMessage(
+                content=f"""
 Based on the user's response, update the objective.
 
 Current objective:
@@ -127,7 +192,7 @@ Current objective:
 ---
 
 Agent's message:
-{response.message_to_user}
+{state.pending_agent_response}
 
 User's response:
 {user_response}
@@ -139,31 +204,33 @@ Important:
 - Keep the format of the current objective.
 - Don't use xml tags in the response. Just return the content of the objective.
 """.strip()
-                )
-            ]
-        )
+            )
+        ]
+    )
 
-        return Command(
-            update={
-                "step_message_history": [
-                    AIMessage(content=response.message_to_user),
-                    HumanMessage(
-                        content=f"""
+    return Command(
+        update={
+            "step_message_history": [
+                AIMessage(content=state.pending_agent_response),
+                HumanMessage(
+                    content=f"""
 The user said:
 {user_response}
 
 And we updated the objective to:
 {new_objective}
 """.strip()
-                    ),
-                ],
-                "objective": new_objective,
-            },
-            goto=agent.__name__,
-        )
+                ),
+            ],
+            "objective": new_objective,
+            # Consumed, so a stale message never reaches the next interrupt
+            "pending_agent_response": "",
+        },
+        goto=agent.__name__,
+    )
 
 
-def rendevous(state: StepState):
+async def rendevous(state: StepState):
     if (
         state.checklist_validation_result is not None
         and state.checklist_validation_result.pass_the_validation
@@ -173,23 +240,27 @@ def rendevous(state: StepState):
         return Command(goto=agent.__name__)
 
 
-g = StateGraph(OverallState)
-g.add_edge(START, init_message_history.__name__)
+builder = StateGraph(OverallState)
+builder.add_edge(START, init_message_history.__name__)
 
-g.add_node(init_message_history, retry=retry_policy)
-g.add_edge(init_message_history.__name__, agent.__name__)
+builder.add_node(init_message_history, retry=retry_policy)
+builder.add_edge(init_message_history.__name__, agent.__name__)
 
-g.add_node(
-    agent, destinations=(agent.__name__, "checklist_validator", END), retry=retry_policy
+builder.add_node(
+    agent,
+    destinations=(ask_user.__name__, "checklist_validator", END),
+    retry=retry_policy,
 )
 
-g.add_node(get_checklist_validator_node(CHECKLIST, StepState), retry=retry_policy)
-g.add_edge("checklist_validator", rendevous.__name__)
+builder.add_node(ask_user, destinations=(agent.__name__,), retry=retry_policy)
 
-g.add_node(rendevous, destinations=(agent.__name__, END), retry=retry_policy)
+builder.add_node(get_checklist_validator_node(CHECKLIST, StepState), retry=retry_policy)
+builder.add_edge("checklist_validator", rendevous.__name__)
 
-g = g.compile()
+builder.add_node(rendevous, destinations=(agent.__name__, END), retry=retry_policy)
 
 
-with open("step_1_define_objective.png", "wb") as f:
-    f.write(g.get_graph().draw_mermaid_png())
+@functools.cache
+def graph():
+    """Compiles the step graph on first use instead of at import."""
+    return builder.compile()
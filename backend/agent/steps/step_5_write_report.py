@@ -1,3 +1,8 @@
+import asyncio
+import functools
+from contextlib import aclosing
+
+from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import (
     ChatPromptTemplate,
@@ -8,33 +13,45 @@ from langchain_core.prompts import (
 from langgraph.graph import START, StateGraph
 from langgraph.config import get_stream_writer
 
-from agent.llms import reasoning_model_large
-from agent.state import OverallState
-from agent.common import retry_policy
-from agent.utils import get_variable_descriptions
+from agent import llms
+from agent.state import OverallState, Step
+from agent.common import get_close_e2b_sandbox_node, retry_policy
+from agent.llm_cache import astream_text
+from agent.utils import VariableIdentityCache, get_variable_descriptions
 
 
-def agent(state: OverallState):
-    writer = get_stream_writer()
-    writer(
-        {
-            "stream_message": "📄 Preparing final comprehensive report...",
-            "current_step": 5,
-        }
-    )
+# Prompts of recent report calls, reused when the call is retried
+INPUT_MESSAGES_CACHE_SIZE = 8
+_input_messages_cache = VariableIdentityCache(INPUT_MESSAGES_CACHE_SIZE)
 
-    input_messages = ChatPromptTemplate.from_messages(
-        [
-            SystemMessagePromptTemplate.from_template(
-                """
-You are a data analyst agent. Currently you are in the final step of the data analysis process: Write Report. In this step your goal is to synthesize all the findings from previous analysis steps into a comprehensive, cohesive final report that directly answers the original objective.
+# Step reports longer than this (in characters) are condensed before the final call
+STEP_REPORT_SUMMARY_THRESHOLD = 8000
+STEP_REPORT_SUMMARY_CONCURRENCY = 4
 
-# Original Objective: {objective}
+STEP_REPORT_SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        HumanMessagePromptTemplate.from_template(
+            """
+Here is the report of the "{step_name}" step of a data analysis:
 
-# Reports from Previous Steps:
-{step_reports}
+<report>
+{report}
+</report>
+
+Condense this report for the writer of the final report. Keep every finding, number, variable name and method detail (features, weights, formulas), and drop repetition and filler. Don't add anything that isn't in the report.
+    """.strip()
+        ),
+    ]
+)
 
----
+
+WRITE_REPORT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(
+            [
+                # Static instructions first so providers can cache them as a prefix
+                """
+You are a data analyst agent. Currently you are in the final step of the data analysis process: Write Report. In this step your goal is to synthesize all the findings from previous analysis steps into a comprehensive, cohesive final report that directly answers the original objective.
 
 Your task is to:
 1. Review all the findings from the data exploration and analysis steps
@@ -48,10 +65,17 @@ Your task is to:
    - Any limitations or caveats
 
 The report should be well-structured, professional, and accessible to both technical and non-technical stakeholders. The report should be in markdown format.
-    """.strip()
-            ),
-            HumanMessagePromptTemplate.from_template(
+""".strip(),
                 """
+# Original Objective: {objective}
+
+# Reports from Previous Steps:
+{step_reports}
+""".strip(),
+            ]
+        ),
+        HumanMessagePromptTemplate.from_template(
+            """
 Please write the final comprehensive report based on all the analysis conducted. Don't say "Sure I will write the report" or anything like that. Just return the report.
 
 Here are final variables created from the analysis. You can refer to this when filling the details of the report. Especially if the user asked for specific data such as the top 10 investment opportunities, you should use data from these variables.
@@ -59,23 +83,102 @@ Here are final variables created from the analysis. You can refer to this when f
 {final_variables}
 
 Don't forget to use markdown format for the report!
-    """.strip()
-            ),
-        ]
-    ).format_messages(
+""".strip()
+        ),
+    ]
+)
+
+
+async def condense_step_reports(steps: list[Step]) -> dict[int, str]:
+    """
+    Condenses the long step reports in parallel so the final call's prompt stays small.
+
+    Args:
+        steps: The steps of the analysis
+
+    Returns:
+        dict[int, str]: The report to use for each step order, condensed if it was long
+    """
+    reports = {step.order: step.report for step in steps if len(step.report) > 10}
+    long_steps = [
+        step for step in steps if len(step.report) > STEP_REPORT_SUMMARY_THRESHOLD
+    ]
+    if not long_steps:
+        return reports
+
+    summaries = await (
+        STEP_REPORT_SUMMARY_PROMPT
+        | llms.get_model("reasoning_model")
+        | StrOutputParser()
+    ).abatch(
+        [{"step_name": step.name, "report": step.report} for step in long_steps],
+        # Some providers default to running a batch one at a time
+        config={"max_concurrency": STEP_REPORT_SUMMARY_CONCURRENCY},
+    )
+    for step, summary in zip(long_steps, summaries):
+        reports[step.order] = summary
+    return reports
+
+
+async def build_input_messages(state: OverallState) -> list[BaseMessage]:
+    """
+    Builds the prompt of the final report call, reusing the one built for the same
+    objective, step reports and variables so that a retry doesn't condense the step
+    reports again.
+
+    Args:
+        state: The graph state
+
+    Returns:
+        list[BaseMessage]: The formatted prompt messages
+    """
+    key = (
+        state.objective,
+        tuple((step.order, step.report) for step in state.steps),
+    )
+    cached_input_messages = _input_messages_cache.get(state.variables, key)
+    if cached_input_messages is not None:
+        return cached_input_messages
+
+    step_reports, final_variables = await asyncio.gather(
+        condense_step_reports(state.steps),
+        asyncio.to_thread(get_variable_descriptions, state.variables, truncate=False),
+    )
+
+    input_messages = WRITE_REPORT_PROMPT.format_messages(
         objective=state.objective,
         step_reports="\n\n".join(
-            [
-                f"<step_{step.order}>\n{step.report}\n</step_{step.order}>"
-                for step in state.steps
-                if step.report and len(step.report) > 10
-            ]
+            f"<step_{order}>\n{report}\n</step_{order}>"
+            for order, report in step_reports.items()
         ),
-        final_variables=get_variable_descriptions(state.variables, truncate=False),
+        final_variables=final_variables,
     )
 
+    _input_messages_cache.set(state.variables, input_messages, key)
+    return input_messages
+
+
+async def agent(state: OverallState):
+    writer = get_stream_writer()
+    writer(
+        {
+            "stream_message": "📄 Preparing final comprehensive report...",
+            "current_step": 5,
+        }
+    )
+
+    input_messages = await build_input_messages(state)
+
     writer({"oneline_message": "✍️ Generating final report..."})
-    response = (reasoning_model_large | StrOutputParser()).invoke(input_messages)
+    # Stream the report so that the user can start reading it while it's written
+    chunks = []
+    async with aclosing(
+        astream_text(llms.get_model("reasoning_model_large"), input_messages)
+    ) as stream:
+        async for chunk in stream:
+            writer({"report_chunk": chunk})
+            chunks.append(chunk)
+    response = "".join(chunks)
 
     writer({"oneline_message": "🎉 Final report completed!"})
 
@@ -84,13 +187,20 @@ Don't forget to use markdown format for the report!
     }
 
 
-g = StateGraph(OverallState)
+# Shared nodes
+close_e2b_sandbox = get_close_e2b_sandbox_node(OverallState)
+
+builder = StateGraph(OverallState)
 
-g.add_edge(START, agent.__name__)
+builder.add_edge(START, agent.__name__)
+builder.add_node(agent, retry=retry_policy)
 
-g.add_node(agent, retry=retry_policy)
+# No more code runs after step 4, so shut the sandbox down while the report is written
+builder.add_edge(START, close_e2b_sandbox.__name__)
+builder.add_node(close_e2b_sandbox)
 
-g = g.compile()
 
-with open("step_5_write_report.png", "wb") as f:
-    f.write(g.get_graph().draw_mermaid_png())
+@functools.cache
+def graph():
+    """Compiles the step graph on first use instead of at import."""
+    return builder.compile()
@@ -1,51 +1,115 @@
+import io
 import os
 import json
 import pickle
+import functools
+import threading
+import weakref
 import pandas as pd
-from typing import Union, Any, Tuple
+import pyarrow as pa
+from typing import Union, Any, Tuple, Iterator
+from collections import OrderedDict
 
 from e2b_code_interpreter import Sandbox
 from e2b_code_interpreter.models import Result
 
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_core.output_parsers import StrOutputParser
 from langgraph.checkpoint.serde.base import SerializerProtocol
 
 from agent.state import Step, Data, DataType
 
+try:
+    import orjson
+except ImportError:  # Optional, comes with langsmith on CPython
+    orjson = None
+
 
 MAX_SAMPLE_ITEMS = 30
 MAX_SAMPLE_LENGTH = 10000
 
+E2B_SANDBOX_TIMEOUT = 60 * 10
+
+PROMPT_HELPER_CACHE_SIZE = 32
+
+
+def _dataframe_to_arrow_ipc(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _dataframe_from_arrow_ipc(data: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(pa.BufferReader(data)).read_all().to_pandas()
+
+
+def _holds_only_strings(values) -> bool:
+    # Object values only round-trip unchanged through Arrow when they are exactly
+    # str or None: lists come back as numpy arrays, NaN and pd.NA come back as None
+    # and str subclasses such as numpy.str_ come back as plain str
+    return set(map(type, values)) <= {str, type(None)}
+
+
+def _is_arrow_safe(df: pd.DataFrame) -> bool:
+    # Arrow doesn't store the freq of a DatetimeIndex or TimedeltaIndex
+    if getattr(df.index, "freq", None) is not None:
+        return False
+    if getattr(df.columns, "freq", None) is not None:
+        return False
+    if not df.columns.is_unique:
+        return False
+    # The index is written as ordinary columns, so its levels are checked the same way
+    index_levels = (
+        df.index.get_level_values(level) for level in range(df.index.nlevels)
+    )
+    return all(
+        _holds_only_strings(level.to_numpy())
+        for level in index_levels
+        if level.dtype == object
+    ) and all(
+        _holds_only_strings(df.iloc[:, i].to_numpy())
+        for i, dtype in enumerate(df.dtypes)
+        if dtype == object
+    )
+
+
+class _CheckpointPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if type(obj) is pd.DataFrame and _is_arrow_safe(obj):
+            try:
+                return _dataframe_from_arrow_ipc, (_dataframe_to_arrow_ipc(obj),)
+            except (pa.ArrowException, TypeError, ValueError):
+                pass
+        return NotImplemented
+
 
 class CustomSerializer(SerializerProtocol):
-    """Custom serializer that handles pandas DataFrames and other objects."""
+    """
+    Checkpoint serializer that pickles state values, pandas DataFrames included.
+
+    DataFrames are pickled natively instead of going through to_dict(), which was
+    slower and dropped dtypes and index types. The highest pickle protocol is used
+    so the numpy buffers behind DataFrames are written without extra copies.
+    DataFrames that Arrow can round-trip are written as Arrow IPC streams instead,
+    which is much faster for string columns than pickling every cell.
+    """
 
     def dumps(self, obj: Any) -> bytes:
-        if isinstance(obj, pd.DataFrame):
-            # For DataFrames, we'll pickle them with a special type marker
-            return pickle.dumps(("DataFrame", obj.to_dict()))
-        return pickle.dumps(obj)
+        buffer = io.BytesIO()
+        _CheckpointPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+        return buffer.getvalue()
 
     def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
-        if isinstance(obj, pd.DataFrame):
-            # For DataFrames, we'll pickle them with a special type marker
-            return "DataFrame", pickle.dumps(obj.to_dict())
-        return "pickle", pickle.dumps(obj)
+        return "pickle", self.dumps(obj)
 
     def loads(self, data: bytes) -> Any:
-        obj = pickle.loads(data)
-        if isinstance(obj, tuple) and obj[0] == "DataFrame":
-            # If it's our special DataFrame format, reconstruct it
-            return pd.DataFrame.from_dict(obj[1])
-        return obj
+        return pickle.loads(data)
 
     def loads_typed(self, data: Tuple[str, bytes]) -> Any:
-        type_str, bytes_data = data
-        if type_str == "DataFrame":
-            # If it's a DataFrame type, reconstruct it
-            return pd.DataFrame.from_dict(pickle.loads(bytes_data))
-        return pickle.loads(bytes_data)
+        _, bytes_data = data
+        return self.loads(bytes_data)
 
 
 def get_current_step(plan: list[Step]) -> Union[Step, None]:
@@ -55,13 +119,87 @@ def get_current_step(plan: list[Step]) -> Union[Step, None]:
     return min(not_completed_steps, key=lambda step: step.order)
 
 
+def dumps_json(value: Any, indent: bool = False) -> bytes:
+    """
+    Serializes a value to JSON, with orjson when it's installed.
+
+    Args:
+        value: The value to serialize. Anything that isn't JSON serializable is
+            written as its str()
+        indent: Whether to indent by 2 spaces for readability. Compact otherwise
+
+    Returns:
+        bytes: The UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(value, default=str, option=option)
+        except orjson.JSONEncodeError:
+            # orjson only handles 64-bit integers, the json module has no limit
+            pass
+    if indent:
+        return json.dumps(value, indent=2, default=str).encode()
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+
 def truncate_string_middle(s, max_length):
-    if not isinstance(s, str):
+    if type(s) is not str:
         s = str(s)
-    if len(s) <= max_length:
+    length = len(s)
+    # Most values are short enough, so return them before building anything
+    if length <= max_length:
         return s
     half = max_length // 2
-    return f"{s[:half]} ... [TRUNCATED, {len(s) - max_length} chars omitted] ... {s[-half:]}"
+    return f"{s[:half]} ... [TRUNCATED, {length - max_length} chars omitted] ... {s[-half:]}"
+
+
+def _mark_cacheable(message: BaseMessage, block_index: int = -1) -> BaseMessage:
+    if isinstance(message.content, str):
+        content = [{"type": "text", "text": message.content}]
+    else:
+        content = [
+            {"type": "text", "text": block} if isinstance(block, str) else block
+            for block in message.content
+        ]
+    content[block_index] = {
+        **content[block_index],
+        "cache_control": {"type": "ephemeral"},
+    }
+    return message.model_copy(update={"content": content})
+
+
+def add_cache_breakpoint(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Marks the last message as an Anthropic prompt caching breakpoint so that the
+    whole prefix up to that message is served from the cache on the next call.
+
+    When the system prompt is split into a static block followed by per-run
+    blocks, the static block is marked as well so it stays cached across runs.
+
+    Args:
+        messages: The messages that will be sent to the model
+
+    Returns:
+        list[BaseMessage]: A copy of the messages with the breakpoints marked
+    """
+    if not messages or not messages[-1].content:
+        return messages
+
+    messages = [*messages[:-1], _mark_cacheable(messages[-1])]
+
+    system_message = messages[0]
+    if (
+        len(messages) > 1
+        and isinstance(system_message, SystemMessage)
+        and isinstance(system_message.content, list)
+        and len(system_message.content) > 1
+    ):
+        messages[0] = _mark_cacheable(system_message, block_index=0)
+
+    return messages
 
 
 def get_e2b_sandbox() -> Sandbox:
@@ -79,53 +217,125 @@ def get_e2b_sandbox() -> Sandbox:
         raise Exception("E2B_PYTHON_AGENT_TEMPLATE_ID is not set")
 
     return Sandbox(
-        template=e2b_sandbox_template_id, timeout=60 * 10, request_timeout=60
+        template=e2b_sandbox_template_id,
+        timeout=E2B_SANDBOX_TIMEOUT,
+        request_timeout=60,
     )
 
 
-def upload_file_to_e2b_sandbox(
-    sandbox: Sandbox,
+# Connected sandbox handles, keyed by sandbox id
+_e2b_sandboxes: dict[str, Sandbox] = {}
+
+
+def get_e2b_sandbox_by_id(sandbox_id: str) -> Sandbox:
+    """
+    Returns a handle to a running sandbox, reusing the one that an earlier node call
+    already connected instead of reconnecting to E2B every time.
+
+    Args:
+        sandbox_id: The id of the sandbox to connect to
+
+    Returns:
+        Sandbox: The connected E2B Sandbox instance
+    """
+    sandbox = _e2b_sandboxes.get(sandbox_id)
+    if sandbox is None:
+        sandbox = _e2b_sandboxes[sandbox_id] = Sandbox(sandbox_id=sandbox_id)
+    return sandbox
+
+
+def reconnect_e2b_sandbox(sandbox_id: str) -> Sandbox | None:
+    """
+    Reconnects to a sandbox that an earlier step created and extends its timeout.
+
+    Args:
+        sandbox_id: The id of the sandbox to reconnect to
+
+    Returns:
+        Sandbox | None: The sandbox, or None if it has already been shut down
+    """
+    try:
+        sandbox = get_e2b_sandbox_by_id(sandbox_id)
+        # Fails if the sandbox has timed out or was killed in the meantime
+        sandbox.set_timeout(E2B_SANDBOX_TIMEOUT)
+        return sandbox
+    except Exception as e:
+        print(f"Failed to reconnect to sandbox {sandbox_id}: {e}")
+        forget_e2b_sandbox(sandbox_id)
+        return None
+
+
+def register_e2b_sandbox(sandbox: Sandbox) -> None:
+    _e2b_sandboxes[sandbox.sandbox_id] = sandbox
+
+
+def forget_e2b_sandbox(sandbox_id: str) -> None:
+    _e2b_sandboxes.pop(sandbox_id, None)
+
+
+def get_e2b_variables_dir() -> str:
+    """Returns the sandbox directory where the variables are uploaded."""
+    dataframe_dir = os.getenv("E2B_VARIABLES_DIR")
+    if dataframe_dir is None:
+        print("E2B_VARIABLES_DIR is not set. Using /tmp as fallback.")
+        dataframe_dir = "/tmp"  # fallback directory
+    return dataframe_dir
+
+
+def _dataframe_to_parquet(df: pd.DataFrame) -> bytes | None:
+    # Parquet is smaller than CSV and keeps dtypes and the index, so the sandbox
+    # doesn't have to infer the types again. pyarrow is in the sandbox image.
+    try:
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, engine="pyarrow")
+        return buffer.getvalue()
+    except (pa.ArrowException, TypeError, ValueError):
+        return None
+
+
+def serialize_file_for_e2b_sandbox(
     variable: Union[pd.DataFrame, list, dict, tuple, str],
     filename_key: str,
-) -> str:
+) -> tuple[str, Union[str, bytes]]:
     """
-    Uploads data to an existing E2B sandbox.
+    Serializes data into a file that can be written to an E2B sandbox.
 
     Args:
-        sandbox: The E2B Sandbox instance to upload to
         data: The data to write to the sandbox. Can be:
-            - pandas DataFrame (saved as CSV)
+            - pandas DataFrame (saved as Parquet, or CSV when Parquet can't hold it)
             - list, dict, or tuple (saved as JSON)
         filename_key: The filename/key to use for the file
 
     Returns:
-        str: The file path where the file was written
+        tuple[str, str | bytes]: The file path in the sandbox and the file content
 
     Raises:
         ValueError: If data type is not supported
     """
-    dataframe_dir = os.getenv("E2B_VARIABLES_DIR")
-    if dataframe_dir is None:
-        print("E2B_VARIABLES_DIR is not set. Using /tmp as fallback.")
-        dataframe_dir = "/tmp"  # fallback directory
+    dataframe_dir = get_e2b_variables_dir()
 
     # Handle different data types
     if isinstance(variable, pd.DataFrame):
-        # For DataFrames, save as CSV
-        file_content = variable.to_csv()
-        if not filename_key.endswith(".csv"):
-            filename_key = f"{filename_key}.csv"
+        file_content = _dataframe_to_parquet(variable)
+        if file_content is not None:
+            if not filename_key.endswith(".parquet"):
+                filename_key = f"{filename_key}.parquet"
+        else:
+            # For DataFrames that Parquet can't hold, save as CSV
+            file_content = variable.to_csv()
+            if not filename_key.endswith(".csv"):
+                filename_key = f"{filename_key}.csv"
     elif isinstance(variable, (list, dict, tuple)):
         # For list, dict, tuple, save as JSON
         try:
-            file_content = json.dumps(variable, indent=2, default=str)
+            # Only the sandbox reads this file, so it's written compact
+            file_content = dumps_json(variable)
             if not filename_key.endswith(".json"):
                 filename_key = f"{filename_key}.json"
         except (TypeError, ValueError) as e:
-            # If JSON serialization fails, fall back to pickle
-            file_content = pickle.dumps(variable).decode(
-                "latin-1"
-            )  # Use latin-1 for binary safety
+            # If JSON serialization fails, fall back to pickle. The bytes are written
+            # as they are, a decoded string would be re-encoded as UTF-8 on upload
+            file_content = pickle.dumps(variable, protocol=5)
             if not filename_key.endswith(".pkl"):
                 filename_key = f"{filename_key}.pkl"
     elif isinstance(variable, str):
@@ -137,21 +347,48 @@ def upload_file_to_e2b_sandbox(
             f"Unsupported data type: {type(variable)}. Supported types: DataFrame, list, dict, tuple"
         )
 
-    file_path = os.path.join(dataframe_dir, filename_key)
-    sandbox.files.write(file_path, file_content)
+    return os.path.join(dataframe_dir, filename_key), file_content
 
-    return file_path
+
+def upload_files_to_e2b_sandbox(sandbox: Sandbox, variables: list[Data]) -> list[str]:
+    """
+    Uploads the variables to an existing E2B sandbox in a single request.
+
+    Args:
+        sandbox: The E2B Sandbox instance to upload to
+        variables: The variables to upload. The variables directory must exist already
+
+    Returns:
+        list[str]: The file path of each variable, in order
+    """
+    files = [
+        serialize_file_for_e2b_sandbox(
+            variable.value, f"{variable.key}.{variable.type}"
+        )
+        for variable in variables
+    ]
+    if files:
+        sandbox.files.write([{"path": path, "data": data} for path, data in files])
+    return [path for path, _ in files]
 
 
 def get_code_to_load_uploaded_file(variables: list[Data], file_paths: list[str]) -> str:
-    code = ["import pandas as pd", "import json"]
+    code = ["import pandas as pd", "import json", "import pickle"]
     for variable, file_path in zip(variables, file_paths):
         if variable.type == DataType.DATAFRAME:
-            code.append(f"{variable.key} = pd.read_csv('{file_path}')")
+            if file_path.endswith(".parquet"):
+                code.append(f"{variable.key} = pd.read_parquet('{file_path}')")
+            else:
+                code.append(f"{variable.key} = pd.read_csv('{file_path}')")
         elif variable.type == DataType.JSON:
-            code.append(
-                f"with open('{file_path}', 'r') as f: {variable.key} = json.load(f)"
-            )
+            if file_path.endswith(".pkl"):
+                code.append(
+                    f"with open('{file_path}', 'rb') as f: {variable.key} = pickle.load(f)"
+                )
+            else:
+                code.append(
+                    f"with open('{file_path}', 'r') as f: {variable.key} = json.load(f)"
+                )
         elif variable.type == DataType.TEXT or variable.type == DataType.STRING:
             code.append(f"{variable.key} = open('{file_path}', 'r').read()")
         # elif variable.type == DataType.PNG:
@@ -170,7 +407,7 @@ def _get_sample(variable: Data, truncate: bool = True) -> str:
         else:
             return variable.value.head(MAX_SAMPLE_ITEMS).to_string()
     elif variable.type == DataType.JSON:
-        dumped_json = json.dumps(variable.value, indent=2, default=str)
+        dumped_json = dumps_json(variable.value, indent=True).decode()
         if truncate:
             return truncate_string_middle(dumped_json, 1000)
         else:
@@ -196,6 +433,31 @@ def _convert_periods(obj):
     return obj
 
 
+def _convert_period_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces pd.Period values with strings, only touching the columns that can hold
+    them. Numeric and plain string columns are skipped without a per-cell call.
+    """
+    columns_to_convert = [
+        i
+        for i, dtype in enumerate(df.dtypes)
+        if isinstance(dtype, pd.PeriodDtype)
+        or (
+            dtype == object
+            # "mixed" covers cells holding dicts and lists, which can nest Periods
+            and pd.api.types.infer_dtype(df.iloc[:, i], skipna=True)
+            in ("period", "mixed")
+        )
+    ]
+    if not columns_to_convert:
+        return df
+
+    df = df.copy()
+    for i in columns_to_convert:
+        df.isetitem(i, df.iloc[:, i].map(_convert_periods).astype(object))
+    return df
+
+
 def parse_e2b_execution_results(results: list[Result]) -> list[tuple[Any, DataType]]:
     parsed_results = []
     for result in results:
@@ -203,7 +465,7 @@ def parse_e2b_execution_results(results: list[Result]) -> list[tuple[Any, DataTy
         if "data" in formats:
             try:
                 value = pd.DataFrame(result.data)
-                value = value.map(lambda x: _convert_periods(x))
+                value = _convert_period_columns(value)
                 parsed_results.append((value, DataType.DATAFRAME))
             except Exception as e:
                 print(f"Error converting data to pandas DataFrame: {e}")
@@ -229,23 +491,97 @@ def parse_e2b_execution_results(results: list[Result]) -> list[tuple[Any, DataTy
     return parsed_results
 
 
-def format_results(parsed_results: list[tuple[Any, DataType]]) -> str:
-    formatted_values = []
-    for value, data_type in parsed_results:
-        if data_type == DataType.DATAFRAME:
+def format_execution_results_stream(results: list[Result]) -> Iterator[str]:
+    """Yield one formatted string per execution result for the agent's message.
+
+    Unlike parse_e2b_execution_results, the values are not kept around, so each
+    result is formatted as soon as it is read and only the preview is built.
+    """
+    for result in results:
+        formats = result.formats()
+        if "data" in formats:
+            try:
+                value = pd.DataFrame(result.data)
+            except Exception as e:
+                print(f"Error converting data to pandas DataFrame: {e}")
+                raise ValueError(f"Failed to convert data to DataFrame: {e}")
             # For DataFrames, show first few rows and dimensions
-            formatted_values.append(
-                f"DataFrame ({value.shape[0]} rows x {value.shape[1]} columns):\n{value.head(3).to_string()}"
-            )
-        elif data_type == DataType.JSON:
-            # For JSON, truncate if too large
-            formatted_values.append(truncate_string_middle(str(value), 1000))
+            head = _convert_period_columns(value.head(3))
+            yield f"DataFrame ({value.shape[0]} rows x {value.shape[1]} columns):\n{head.to_string()}"
+        elif "json" in formats:
+            if result.json is None:
+                print("Error processing json data: No json data")
+                raise ValueError("Failed to process json data: No json data")
+            yield truncate_string_middle(str(result.json), 1000)
+        elif "text" in formats:
+            yield truncate_string_middle(result.text, 1000)
+        elif "png" in formats:
+            yield truncate_string_middle(str(result.png), 1000)
         else:
-            # For other types, truncate if too large
-            formatted_values.append(truncate_string_middle(str(value), 1000))
-    return "\n".join(formatted_values)
+            raise ValueError(f"Unsupported data type: {formats}")
+
+
+class VariableIdentityCache:
+    """
+    LRU cache of values built from a list of Data objects, keyed on their identity.
+
+    Data holds unhashable values such as DataFrames, so entries are keyed on the ids
+    of the variables instead. The variables are only referenced weakly, so a cached
+    entry never keeps a finished session's data alive, and an entry whose variables
+    were collected can't be hit by new objects that reuse their ids.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, variables: list[Data], key: Any = ()) -> Any:
+        """Returns the cached value, or None if there is no live entry"""
+        full_key = (tuple(id(variable) for variable in variables), key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is None:
+                return None
+            refs, value = entry
+            if any(ref() is not variable for ref, variable in zip(refs, variables)):
+                del self._entries[full_key]
+                return None
+            self._entries.move_to_end(full_key)
+            return value
+
+    def set(self, variables: list[Data], value: Any, key: Any = ()) -> None:
+        full_key = (tuple(id(variable) for variable in variables), key)
+        refs = tuple(weakref.ref(variable) for variable in variables)
+        with self._lock:
+            self._entries[full_key] = (refs, value)
+            self._entries.move_to_end(full_key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def _cache_by_variable_identity(func):
+    """
+    Memoizes a prompt helper on the identity of the Data objects it is given.
+
+    The variables don't change within a run, so the same list is rendered again
+    each time a step's prompt is built.
+    """
+    cache = VariableIdentityCache(PROMPT_HELPER_CACHE_SIZE)
 
+    @functools.wraps(func)
+    def wrapper(variables: list[Data], *args, **kwargs):
+        key = (args, tuple(kwargs.items()))
+        result = cache.get(variables, key)
+        if result is None:
+            result = func(variables, *args, **kwargs)
+            cache.set(variables, result, key)
+        return result
 
+    return wrapper
+
+
+@_cache_by_variable_identity
 def get_variable_descriptions(variables: list[Data], truncate: bool = True) -> str:
     return "\n".join(
         [
@@ -255,6 +591,7 @@ def get_variable_descriptions(variables: list[Data], truncate: bool = True) -> s
     )
 
 
+@_cache_by_variable_identity
 def get_dataframe_info(variables: list[Data]) -> str:
     for variable in variables:
         if variable.type == DataType.DATAFRAME:
@@ -264,31 +601,52 @@ def get_dataframe_info(variables: list[Data]) -> str:
             # Basic Information
             info_sections.append(f"Shape: {df.shape} (rows × columns)")
 
-            # Data Types and Non-null Counts
-            for col in df.columns:
-                dtype = str(df[col].dtype)
-                non_null = df[col].count()
-                null_count = len(df) - non_null
-                null_percentage = (null_count / len(df)) * 100 if len(df) > 0 else 0
+            # Data Types and Non-null Counts, counted for all columns in one call
+            row_count = len(df)
+            for col, dtype, non_null in zip(df.columns, df.dtypes, df.count()):
+                null_count = row_count - non_null
+                null_percentage = (null_count / row_count) * 100 if row_count > 0 else 0
                 info_sections.append(
                     f"{col}: {dtype} | Non-null: {non_null} | Missing: {null_count} ({null_percentage:.1f}%)"
                 )
 
+            # Split the columns by dtype in one pass, matching select_dtypes'
+            # "number" and ["object", "category"] without building sub-frames
+            numeric_positions, categorical_positions = [], []
+            for i, dtype in enumerate(df.dtypes):
+                if (
+                    pd.api.types.is_numeric_dtype(dtype)
+                    and not pd.api.types.is_bool_dtype(dtype)
+                ) or pd.api.types.is_timedelta64_dtype(dtype):
+                    numeric_positions.append(i)
+                elif dtype == object or isinstance(dtype, pd.CategoricalDtype):
+                    categorical_positions.append(i)
+
             # Descriptive Statistics for Numeric Columns
-            numeric_cols = df.select_dtypes(include=["number"]).columns
-            if len(numeric_cols) > 0:
-                desc_stats = df[numeric_cols].describe()
+            if numeric_positions:
+                desc_stats = df.iloc[:, numeric_positions].describe()
                 info_sections.append(desc_stats.to_string())
 
             # Categorical Columns Summary
-            categorical_cols = df.select_dtypes(include=["object", "category"]).columns
-            if len(categorical_cols) > 0:
-                for col in categorical_cols:
-                    unique_count = df[col].nunique()
-                    most_frequent = df[col].mode()
-                    if len(most_frequent) > 0:
-                        most_frequent_value = most_frequent.iloc[0]
-                        most_frequent_count = df[col].value_counts().iloc[0]
+            if categorical_positions:
+                for i in categorical_positions:
+                    col = df.columns[i]
+                    # A single value_counts pass gives the unique count and the mode
+                    value_counts = df.iloc[:, i].value_counts()
+                    # Categoricals also list their unused categories with a zero count
+                    value_counts = value_counts[value_counts > 0]
+                    unique_count = len(value_counts)
+                    if unique_count > 0:
+                        most_frequent_count = value_counts.iat[0]
+                        # mode() breaks ties by sort order, not by count order
+                        tied_values = value_counts.index[
+                            value_counts.to_numpy() == most_frequent_count
+                        ]
+                        most_frequent_value = (
+                            tied_values[0]
+                            if len(tied_values) == 1
+                            else pd.Series(tied_values).mode().iloc[0]
+                        )
                         info_sections.append(
                             f"{col}: {unique_count} unique values | Most frequent: '{most_frequent_value}' ({most_frequent_count} times)"
                         )
@@ -301,16 +659,26 @@ def get_dataframe_info(variables: list[Data]) -> str:
 
 string_output_parser = StrOutputParser()
 
+CODE_BLOCK_OPENING = "```python"
+
+
+def strip_code_comments(code: str) -> str:
+    """Drop blank and comment-only lines, leaving the lines that actually run."""
+    return "\n".join(
+        line
+        for line in code.splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    )
+
 
 def extract_code_block(response: BaseMessage) -> str | None:
     content = string_output_parser.invoke(response)
 
-    if "DONE" in content:
+    start = content.find(CODE_BLOCK_OPENING)
+    if start < 0:
         return None
+    start += len(CODE_BLOCK_OPENING)
 
-    try:
-        code_block = content.split("```python")[1].split("```")[0].strip()
-        return code_block
-    except Exception as e:
-        # print(f"Error parsing code block: {e}\n\nCode Block:\n{content}")
-        return None
+    # An unclosed block runs to the end of the response
+    end = content.find("```", start)
+    return content[start : end if end >= 0 else None].strip()
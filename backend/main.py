@@ -1,7 +1,9 @@
 import os
 import json
-import pandas as pd
+import asyncio
+import functools
 from datetime import datetime
+from contextlib import asynccontextmanager
 
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
@@ -14,14 +16,38 @@ from fastapi.websockets import WebSocketDisconnect
 from langgraph.types import Command
 from langchain_core.runnables import RunnableConfig
 
-from agent.state import Data, DataType
-from agent.entry_graph import g
-
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
-app = FastAPI(title="Data Analyst Agent API", version="0.1.0")
+
+@functools.cache
+def get_graph():
+    """
+    Imports and returns the entry graph on first use.
+
+    Importing the agent pulls in pandas, LangChain and every step graph, so it is
+    kept out of module import and warmed up in the background at startup instead.
+    """
+    from agent.entry_graph import g
+
+    return g
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from agent.sandbox_pool import sandbox_pool
+
+    # Keep E2B sandboxes warm so that new sessions skip the sandbox cold start
+    sandbox_pool.start()
+    # Load the graph while the server is already accepting connections
+    warm_up = asyncio.create_task(asyncio.to_thread(get_graph))
+    yield
+    await asyncio.to_thread(sandbox_pool.stop)
+    await warm_up
+
+
+app = FastAPI(title="Data Analyst Agent API", version="0.1.0", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -49,6 +75,9 @@ class AnalysisRequest(BaseModel):
     data_file_path: Optional[str] = "./backend/run/melb_2bed.csv"
 
 
+# Custom stream events from the graph that are forwarded to the frontend as they are
+FORWARDED_CUSTOM_KEYS = ("oneline_message", "current_step", "report_chunk")
+
 # Global storage for active sessions
 active_sessions: Dict[str, Dict[str, Any]] = {}
 
@@ -78,6 +107,9 @@ And here are the details:
 
 def create_graph_input(request: AnalysisRequest) -> Dict[str, Any]:
     """Create graph input from analysis request"""
+    import pandas as pd
+    from agent.state import Data, DataType
+
     objective = create_objective(request)
 
     # Load the data
@@ -110,9 +142,12 @@ def create_graph_input(request: AnalysisRequest) -> Dict[str, Any]:
 @app.websocket("/agent/")
 async def websocket_analysis(websocket: WebSocket):
     """WebSocket endpoint for real-time analysis"""
+    config = None
     try:
         await websocket.accept()
 
+        g = await asyncio.to_thread(get_graph)
+
         # Receive initial data from frontend
         data = await websocket.receive_json()
 
@@ -151,38 +186,39 @@ async def websocket_analysis(websocket: WebSocket):
             "websocket": websocket,
         }
 
-        # Stream the graph execution
-        try:
+        async def stream_graph(graph_input_or_command):
+            """
+            Runs the graph until it ends or interrupts, forwarding custom events.
+
+            Returns:
+                The interrupts the run stopped at, empty if the graph finished
+            """
+            interrupts = ()
             async for stream_mode, chunk in g.astream(
-                graph_input,
+                graph_input_or_command,
                 config=config,
                 stream_mode=["custom", "updates"],
             ):
                 print("--------------------------------")
                 print("stream_mode", stream_mode)
                 print("chunk", chunk)
-                print("chunk type", type(chunk))
                 if stream_mode == "custom":
-                    if "oneline_message" in chunk:
-                        await websocket.send_json(
-                            {"oneline_message": chunk["oneline_message"]}
-                        )
-                        print("oneline_message sent via websocket")
-                    if "current_step" in chunk:
-                        await websocket.send_json(
-                            {"current_step": chunk["current_step"]}
-                        )
-                        print("current_step sent via websocket")
+                    for key in FORWARDED_CUSTOM_KEYS:
+                        if key in chunk:
+                            await websocket.send_json({key: chunk[key]})
+                elif "__interrupt__" in chunk:
+                    interrupts = chunk["__interrupt__"]
+            return interrupts
+
+        # Stream the graph execution
+        try:
+            interrupts = await stream_graph(graph_input)
 
             # Check if we need human input
             while True:
                 try:
-                    state = g.get_state_history(config)
-                    latest_snapshot = next(state)
-                    if latest_snapshot.interrupts:
-                        message_to_user = latest_snapshot.interrupts[0].value[
-                            "message_to_user"
-                        ]
+                    if interrupts:
+                        message_to_user = interrupts[0].value["message_to_user"]
                         active_sessions[session_id]["status"] = "waiting_for_input"
                         active_sessions[session_id]["message_to_user"] = message_to_user
 
@@ -208,28 +244,12 @@ async def websocket_analysis(websocket: WebSocket):
                         # Continue the graph execution
                         active_sessions[session_id]["status"] = "running"
 
-                        async for stream_mode, chunk in g.astream(
-                            Command(resume=user_response.strip()),
-                            config=config,
-                            stream_mode=["custom", "updates"],
-                        ):
-                            print("--------------------------------")
-                            print("stream_mode", stream_mode)
-                            print("chunk", chunk)
-                            print("chunk type", type(chunk))
-                            if stream_mode == "custom":
-                                if "oneline_message" in chunk:
-                                    await websocket.send_json(
-                                        {"oneline_message": chunk["oneline_message"]}
-                                    )
-                                    print("oneline_message sent via websocket")
-                                if "current_step" in chunk:
-                                    await websocket.send_json(
-                                        {"current_step": chunk["current_step"]}
-                                    )
-                                    print("current_step sent via websocket")
+                        interrupts = await stream_graph(
+                            Command(resume=user_response.strip())
+                        )
 
                     else:
+                        latest_snapshot = await g.aget_state(config)
                         print(
                             "Last snapshot doesn't have interrupts:\n", latest_snapshot
                         )
@@ -242,6 +262,9 @@ async def websocket_analysis(websocket: WebSocket):
                             {
                                 "summary": "Analysis Complete",
                                 "content": final_report,
+                                # Replaces the streamed report chunks, which repeat
+                                # text if the report node was retried mid-stream
+                                "final_report": final_report,
                                 "completed": True,
                             }
                         )
@@ -249,8 +272,7 @@ async def websocket_analysis(websocket: WebSocket):
                 except Exception as e:
                     # Analysis completed or error
                     try:
-                        state = g.get_state_history(config)
-                        latest_snapshot = next(state)
+                        latest_snapshot = await g.aget_state(config)
                         active_sessions[session_id]["status"] = "completed"
                         final_report = latest_snapshot.values.get("final_report", "")
                         active_sessions[session_id]["final_report"] = final_report
@@ -284,6 +306,15 @@ async def websocket_analysis(websocket: WebSocket):
         except:
             pass
     finally:
+        if config is not None:
+            # Drop the cached sandbox handle once the session is over
+            try:
+                from agent.utils import forget_e2b_sandbox
+
+                snapshot = await g.aget_state(config)
+                forget_e2b_sandbox(snapshot.values.get("sandbox_id", ""))
+            except Exception as e:
+                print(f"Failed to release the sandbox handle: {e}")
         try:
             await websocket.close()
         except:
@@ -0,0 +1,115 @@
+"""
+Checks that DataFrames come back unchanged from the checkpoint serializer.
+
+CustomSerializer writes DataFrames as Arrow IPC streams when _is_arrow_safe
+allows it, and pickles them natively otherwise. Each case below is a detail
+that Arrow alone would lose, plus frames that should still take the Arrow path.
+Run it from the backend directory:
+
+    python -m scripts.check_checkpoint_roundtrip
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from agent.utils import CustomSerializer, _is_arrow_safe
+
+
+def _build_cases() -> dict[str, tuple[pd.DataFrame, bool]]:
+    # name -> (frame, whether it is expected to go through Arrow)
+    return {
+        "nan in string column": (pd.DataFrame({"s": ["a", float("nan"), None]}), False),
+        "pd.NA in string column": (
+            pd.DataFrame({"s": pd.Series(["a", pd.NA], dtype=object)}),
+            False,
+        ),
+        "numpy.str_ in string column": (
+            pd.DataFrame({"s": ["a", np.str_("b")]}),
+            False,
+        ),
+        "nan in object index": (
+            pd.DataFrame({"a": [1, 2]}, index=pd.Index(["x", np.nan], dtype=object)),
+            False,
+        ),
+        "DatetimeIndex with freq": (
+            pd.DataFrame({"a": range(3)}, index=pd.date_range("2020", periods=3)),
+            False,
+        ),
+        "TimedeltaIndex with freq": (
+            pd.DataFrame(
+                {"a": range(3)}, index=pd.timedelta_range("1D", periods=3, freq="D")
+            ),
+            False,
+        ),
+        "columns with freq": (
+            pd.DataFrame([[1, 2]], columns=pd.date_range("2020", periods=2)),
+            False,
+        ),
+        "lists in object column": (pd.DataFrame({"l": [[1], [2]]}), False),
+        "strings and None": (
+            pd.DataFrame({"s": ["a", None], "f": [1.0, np.nan]}),
+            True,
+        ),
+        "named MultiIndex": (
+            pd.DataFrame(
+                {"a": [1, 2]},
+                index=pd.MultiIndex.from_tuples([("x", 1), ("y", 2)], names=["k", "n"]),
+            ),
+            True,
+        ),
+        "categorical and tz-aware": (
+            pd.DataFrame(
+                {
+                    "c": pd.Categorical(["a", None]),
+                    "t": pd.date_range("2020", periods=2, tz="UTC"),
+                }
+            ),
+            True,
+        ),
+    }
+
+
+def _same_value(a, b) -> bool:
+    if a is b:
+        return True
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a):
+        return math.isnan(b)
+    return type(a) is type(b) and bool(a == b)
+
+
+def _roundtrips(df: pd.DataFrame, back: pd.DataFrame) -> bool:
+    try:
+        pd.testing.assert_frame_equal(back, df)
+    except AssertionError:
+        return False
+    for original, restored in ((df.index, back.index), (df.columns, back.columns)):
+        if getattr(original, "freq", None) != getattr(restored, "freq", None):
+            return False
+        if original.dtype == object and not all(map(_same_value, original, restored)):
+            return False
+    return all(
+        all(map(_same_value, df.iloc[:, i], back.iloc[:, i]))
+        for i, dtype in enumerate(df.dtypes)
+        if dtype == object
+    )
+
+
+def main():
+    serializer = CustomSerializer()
+    failures = 0
+    for name, (df, expect_arrow) in _build_cases().items():
+        uses_arrow = _is_arrow_safe(df)
+        back = serializer.loads(serializer.dumps(df))
+        ok = uses_arrow == expect_arrow and _roundtrips(df, back)
+        failures += not ok
+        print(
+            f"{'ok  ' if ok else 'FAIL'} {name} ({'arrow' if uses_arrow else 'pickle'})"
+        )
+    if failures:
+        raise SystemExit(f"{failures} case(s) failed")
+
+
+if __name__ == "__main__":
+    main()
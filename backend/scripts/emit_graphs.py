@@ -0,0 +1,38 @@
+"""
+Renders the agent graphs to PNG files in agent/diagrams.
+
+Drawing calls out to the remote Mermaid renderer, so it is kept out of the
+graph modules and only done on demand. Run it from the backend directory:
+
+    python -m scripts.emit_graphs
+"""
+
+import os
+import importlib
+
+GRAPH_MODULES = [
+    "agent.entry_graph",
+    "agent.steps.step_1_define_objective",
+    "agent.steps.step_2_data_cleaning",
+    "agent.steps.step_3_data_exploration",
+    "agent.steps.step_4_data_analysis",
+    "agent.steps.step_5_write_report",
+]
+
+DIAGRAMS_DIR = os.path.join(os.path.dirname(__file__), "..", "agent", "diagrams")
+
+
+def main():
+    os.makedirs(DIAGRAMS_DIR, exist_ok=True)
+    for module_name in GRAPH_MODULES:
+        module = importlib.import_module(module_name)
+        file_name = f"{module_name.rsplit('.', 1)[-1]}.png"
+        with open(os.path.join(DIAGRAMS_DIR, file_name), "wb") as f:
+            # The entry graph is compiled at import, the step graphs on first use
+            graph = module.graph() if hasattr(module, "graph") else module.g
+            f.write(graph.get_graph().draw_mermaid_png())
+        print(f"Wrote {file_name}")
+
+
+if __name__ == "__main__":
+    main()
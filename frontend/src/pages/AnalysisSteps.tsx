@@ -90,6 +90,13 @@ const AnalysisSteps = () => {
           return;
         }
 
+        // The final report is streamed in chunks, append them to the report
+        if (response.report_chunk) {
+          setFinalReport((prev) => prev + response.report_chunk);
+          setShowReport(true);
+          return;
+        }
+
         // Add message to the list, handling oneline messages separately
         if (response.oneline_message) {
           setMessages((prev) => [
@@ -108,7 +115,7 @@ const AnalysisSteps = () => {
           setCurrentAnalysisStep(response.current_step);
         }
 
-        // Handle final report
+        // Handle final report, it replaces whatever was streamed in chunks
         if (response.final_report) {
           setFinalReport(response.final_report);
           setShowReport(true);
@@ -126,10 +133,6 @@ const AnalysisSteps = () => {
           setAnalysisCompleted(true);
           setIsLoading(false);
           setWaitingForInput(false);
-          if (!showReport && response.final_report) {
-            setFinalReport(response.final_report);
-            setShowReport(true);
-          }
         }
       };
 
@@ -201,6 +204,13 @@ const AnalysisSteps = () => {
           return;
         }
 
+        // The final report is streamed in chunks, append them to the report
+        if (response.report_chunk) {
+          setFinalReport((prev) => prev + response.report_chunk);
+          setShowReport(true);
+          return;
+        }
+
         if (response.oneline_message) {
           setMessages((prev: Message[]) => [
             ...prev,
@@ -218,7 +228,7 @@ const AnalysisSteps = () => {
           setCurrentAnalysisStep(response.current_step);
         }
 
-        // Handle final report
+        // Handle final report, it replaces whatever was streamed in chunks
         if (response.final_report) {
           setFinalReport(response.final_report);
           setShowReport(true);